@@ -1,182 +1,892 @@
 import json
 import os
+import sys
+import copy
+import gzip
+import atexit
 import logging
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping, Optional, Tuple
+from collections import deque
+from collections.abc import Sequence
+from itertools import islice
+import heapq
 import threading
 
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # A *.zst data file is then swapped for its plain .json name
+    zstandard = None
+
 logger = logging.getLogger("data-manager")
 
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"  # Leading bytes of every zstd frame
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # fdatasync is POSIX-only
+_O_BINARY = getattr(os, "O_BINARY", 0)  # Disables newline translation on Windows
+
+# WAL group commit: records are buffered, then written with one syscall and
+# synced with one fdatasync, either once this many are pending or after the
+# delay (seconds), whichever is first.
+_WAL_BATCH_RECORDS = 32
+_WAL_GROUP_COMMIT_DELAY = 0.02
+
+# Records logged since the last checkpoint that trigger one early, keeping WAL
+# replay on startup short when the checkpoint interval is long.
+_WAL_COMPACT_RECORDS = 5000
+
+# Initial state, also used to fill in any section or field a loaded file lacks
+_DEFAULTS = {
+    "stats": {
+        "total_threats": 0,
+        "blocked_attacks": 0,
+        "network_traffic": "0 MB",
+        "active_users": 0
+    },
+    "threats": [],
+    "firewall_rules": [],
+    "system_health": {
+        "cpu_usage": 0,
+        "memory_usage": 0,
+        "disk_usage": 0,
+        "network_usage": 0
+    },
+    "alerts": [],
+    "scans": []
+}
+
+# Event-log sections are capped at this many records; older ones are moved to
+# a gzip'd JSON-lines archive next to the data file.
+_BOUNDED_SECTIONS = ("threats", "alerts", "scans")
+_MAX_RECORDS = 10000
+
+# Sections held in memory as an insertion-ordered {id: record} dict and
+# exchanged with callers and the data file as a plain list of records.
+_KEYED_SECTIONS = ("firewall_rules",)
+
+# Record fields drawn from a small set of values (statuses, severities, a few
+# hot source IPs); interning them makes equal values share one str object.
+_INTERNED_FIELDS = ("status", "severity", "type", "action", "source", "source_ip", "destination")
+
+# How far (in records) a threat can land behind newer ones when its report
+# waits on an ML prediction; recent_threats ranks this much extra tail and
+# threats_since scans this many older records past the cutoff
+_REORDER_WINDOW = 64
+
+_MISSING = object()  # Distinguishes an absent stats key from one holding None
+
+# ID prefix -> section whose records get "<prefix>-<n>" ids from a counter
+_ID_SECTIONS = {"threat": "threats", "rule": "firewall_rules", "alert": "alerts", "scan": "scans"}
+_SECTION_PREFIX = {section: prefix for prefix, section in _ID_SECTIONS.items()}
+
+# Top-level sections each WAL op modifies; their cached encodings are dropped
+_OP_SECTIONS = {
+    "update_stats": ("stats",),
+    "add_threat": ("threats", "stats"),
+    "update_threat": ("threats",),
+    "update_threats": ("threats",),
+    "add_firewall_rule": ("firewall_rules", "stats"),
+    "remove_firewall_rule": ("firewall_rules", "stats"),
+    "add_firewall_rules": ("firewall_rules", "stats"),
+    "remove_firewall_rules": ("firewall_rules", "stats"),
+    "add_alert": ("alerts",),
+    "update_system_health": ("system_health",),
+    "add_scan": ("scans",),
+    "update_scan": ("scans",),
+}
+
+def _dumps(obj: Any, indent: bool = False, newline: bool = False) -> bytes:
+    if orjson is not None:
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_APPEND_NEWLINE if newline else 0)
+        return orjson.dumps(obj, default=list, option=option)  # default=list encodes deques
+    return (json.dumps(obj, default=list, indent=2 if indent else None) + ("\n" if newline else "")).encode()
+
+def _write_all(fd: int, buf: bytes) -> None:
+    # os.write is a single syscall for the whole buffer in practice, but may be short
+    view = memoryview(buf)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _intern_fields(record: Dict[str, Any]) -> None:
+    for field in _INTERNED_FIELDS:
+        value = record.get(field)
+        if type(value) is str:
+            record[field] = sys.intern(value)
+
+def _epoch_of(record: Dict[str, Any]) -> float:
+    return record.get("ts_epoch", 0.0)
+
+def _set_epoch(threat: Dict[str, Any]) -> None:
+    """Give a threat stored before ts_epoch existed one, from its ISO stamp."""
+    if "ts_epoch" not in threat:
+        try:
+            threat["ts_epoch"] = datetime.fromisoformat(threat.get("timestamp", "")).timestamp()
+        except (TypeError, ValueError):
+            threat["ts_epoch"] = 0.0
+
+def _id_number(prefix: str, record_id: Any) -> int:
+    """n for an id "<prefix>-<n>", else 0."""
+    head, _, number = str(record_id).partition("-")
+    return int(number) if head == prefix and number.isdigit() else 0
+
+def _changes(record: Dict[str, Any], updates: Dict[str, Any]) -> bool:
+    return any(record.get(k, _MISSING) != v for k, v in updates.items())
+
+def _loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class _RecordsView(Sequence):
+    """Read-only live view of a record section (a deque, or a keyed section's values).
+
+    Records come out as read-only mappings, so neither the section nor its
+    records can be changed past the WAL, the counters and the indexes.
+    """
+    __slots__ = ("_records",)
+
+    def __init__(self, records):
+        self._records = records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self):
+        return map(MappingProxyType, self._records)
+
+    def __reversed__(self):
+        return map(MappingProxyType, reversed(self._records))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [MappingProxyType(r) for r in list(self._records)[index]]
+        try:
+            return MappingProxyType(self._records[index])
+        except TypeError:  # A dict values view is not indexable
+            return MappingProxyType(list(self._records)[index])
+
 class DataManager:
-    def __init__(self, data_file_path: str):
+    """JSON-backed state store.
+
+    The canonical state lives in ``self.cache``. Every mutation is appended as
+    one JSON line to a write-ahead log next to the data file, and the full
+    state is checkpointed to the data file periodically (which empties the
+    log). On startup the checkpoint is loaded and the log replayed on top.
+    """
+
+    def __init__(self, data_file_path: str, checkpoint_interval: float = 5.0):
+        # A ".zst" suffix (e.g. security_data.json.zst) asks for zstd-compressed checkpoints
+        if data_file_path.endswith(".zst") and zstandard is None:
+            # A file's name must never misstate its encoding: without the module
+            # the store uses the plain name, unless a compressed file already
+            # holds the data, which could then not be read
+            if os.path.exists(data_file_path):
+                raise RuntimeError(f"{data_file_path} is zstd-compressed but zstandard is not installed")
+            logger.warning(f"zstandard is not installed, using {data_file_path[:-len('.zst')]} uncompressed")
+            data_file_path = data_file_path[:-len(".zst")]
         self.data_file_path = data_file_path
-        self.lock = threading.Lock()
+        self.compress = data_file_path.endswith(".zst")
+        base_path = os.path.splitext(data_file_path[:-len(".zst")] if self.compress else data_file_path)[0]
+        self.wal_path = base_path + ".wal"
+        self.archive_path = base_path + ".archive.jsonl.gz"
+        # Reused across checkpoints; compression only runs under _io_lock
+        self._compressor = zstandard.ZstdCompressor(level=3) if self.compress else None
+        self._decompressor = zstandard.ZstdDecompressor() if zstandard else None
+        self.checkpoint_interval = checkpoint_interval
+        # _cache_lock guards the in-memory state and WAL appends (short, CPU-only
+        # sections); _io_lock serializes checkpoints, which write and sync a file;
+        # _wal_lock serializes writing and syncing the WAL. Lock order is
+        # _io_lock, then _wal_lock, then _cache_lock.
+        self._cache_lock = threading.RLock()
+        self._io_lock = threading.Lock()
+        self._wal_lock = threading.Lock()
         self.cache = None
+        self._dirty = threading.Event()  # Set by mutators, cleared by a successful checkpoint
+        self._stop = threading.Event()
+        self._wal_seq = 0  # Sequence number of the last record applied to the cache
+        self._wal_pending: List[bytes] = []  # Encoded records not yet written to the WAL
+        self._wal_ready = threading.Event()  # Set while records are pending
+        self._wal_batch = threading.Event()  # Set once _WAL_BATCH_RECORDS are pending
+        self._wal_since_checkpoint = 0  # Records logged after the last checkpoint's snapshot
+        self._wal_full = threading.Event()  # Set once _WAL_COMPACT_RECORDS is reached
+        self._section_bytes: Dict[str, bytes] = {}  # Encoded top-level sections still valid for a checkpoint
+        self._section_json: Dict[str, bytes] = {}  # Compact encodings handed to API responses, same lifetime
+        self._version = 0  # Bumped on every change to the cache
+        self._snapshot = b"{}"  # Encoded state as of _snapshot_version, handed out by load_data
+        self._snapshot_version = -1
+        self._recent_json = (-1, 0, b"[]")  # (_version, limit, encoding) of the last recent_threats_json
+        self._counters: Dict[str, int] = {}  # Last id number handed out per prefix; never decreases
+        self._overflow: List[Tuple[str, Dict[str, Any]]] = []  # Evicted (section, record) pairs awaiting archival
+        # Lookups by id/IP are O(1); rules are keyed by id in the cache itself
+        self._threats_by_id: Dict[str, Dict[str, Any]] = {}
+        self._threats_by_source: Dict[str, Dict[str, None]] = {}  # source IP -> threat ids (ordered set), oldest first
+        self._scans_by_id: Dict[str, Dict[str, Any]] = {}
+        self._rules_by_ip: Dict[str, str] = {}
         self._ensure_data_file_exists()
-        self.load_data()  # Initial load into cache
+        self._checkpointer = threading.Thread(target=self._checkpoint_loop, name="data-checkpoint", daemon=True)
+        self._checkpointer.start()
+        self._wal_writer = threading.Thread(target=self._wal_writer_loop, name="data-wal-writer", daemon=True)
+        self._wal_writer.start()
+        atexit.register(self._final_flush)
 
     def _ensure_data_file_exists(self):
         directory = os.path.dirname(self.data_file_path)
         if not os.path.exists(directory):
             os.makedirs(directory)
-        if not os.path.exists(self.data_file_path):
+        self._wal_fd = os.open(self.wal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | _O_BINARY, 0o644)
+        source_path = self.data_file_path
+        # A store switched to ".zst" starts from the plain file written before
+        # the switch (same base name, so the WAL is shared too)
+        legacy_path = self.data_file_path[:-len(".zst")] if self.compress else None
+        if not os.path.exists(source_path) and legacy_path and os.path.exists(legacy_path):
+            source_path = legacy_path
+        if not os.path.exists(source_path):
             self.reset_data()  # Use reset_data to initialize
+            return
+        self._load_from_file(source_path)
+        replayed = self._replay_wal()
+        self._seed_counters()
+        if replayed:
+            logger.info(f"Replayed {replayed} records from {self.wal_path}")
+        if source_path != self.data_file_path:
+            logger.info(f"Migrating {source_path} to {self.data_file_path}; the old file is no longer read")
+        if replayed or source_path != self.data_file_path:
+            self._checkpoint()
 
     def reset_data(self) -> bool:
         """Reset the security_data.json file to an initial empty state."""
-        initial_data = {
-            "stats": {
-                "total_threats": 0,
-                "blocked_attacks": 0,
-                "network_traffic": "0 MB",
-                "active_users": 0
-            },
-            "threats": [],
-            "firewall_rules": [],
-            "system_health": {
-                "cpu_usage": 0,
-                "memory_usage": 0,
-                "disk_usage": 0,
-                "network_usage": 0
-            },
-            "alerts": [],
-            "scans": []
-        }
-        success = self.save_data(initial_data)
+        success = self.save_data(_DEFAULTS)
         if success:
             logger.info(f"Reset {self.data_file_path} to initial state")
         else:
             logger.error(f"Failed to reset {self.data_file_path}")
         return success
 
-    def load_data(self, update_stats=True) -> Dict[str, Any]:
-        if self.cache is not None and not update_stats:
-            return self.cache.copy()
+    def _load_from_file(self, path: str) -> None:
         try:
-            with self.lock:
-                with open(self.data_file_path, 'r') as f:
-                    data = json.load(f)
-                    if update_stats:
-                        threats = data.get("threats", [])
-                        firewall_rules = data.get("firewall_rules", [])
-                        # Count blocked threats (threats with status "blocked")
-                        blocked_threats = [t for t in threats if t.get("status") == "blocked"]
-                        stats = data.get("stats", {})
-                        # Total threats = all threats + all rules - overlap of blocked threats
-                        stats["total_threats"] = len(threats) 
-                        stats["blocked_attacks"] = len(firewall_rules)
-                        logger.info(stats["total_threats"])
-                        data["stats"] = stats
-                    self.cache = data
-                    return data.copy()
-        except (json.JSONDecodeError, FileNotFoundError) as e:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            if raw.startswith(_ZSTD_MAGIC):
+                if self._decompressor is None:
+                    raise ValueError(f"{path} is zstd-compressed but zstandard is not installed")
+                try:
+                    raw = self._decompressor.decompress(raw)
+                except zstandard.ZstdError as e:
+                    raise ValueError(f"corrupt zstd frame: {str(e)}")
+            self.cache = _loads(raw)
+        except (ValueError, FileNotFoundError) as e:  # Includes JSONDecodeError
             logger.error(f"Error loading data: {str(e)}")
-            return {}
+            self.cache = {}
+        self._wal_seq = self.cache.pop("_wal_seq", 0)
+        self._counters = self.cache.pop("_counters", {})
+        self._prepare_sections()
+        self._rebuild_indexes()
 
-    def save_data(self, data: Dict[str, Any]) -> bool:
-        success = self._save_to_file(data)
-        if success:
-            self.cache = data.copy()
-        return success
+    def _prepare_sections(self) -> None:
+        # Establish the layout every other method relies on: all sections and
+        # stats/health fields present, so lookups can index directly.
+        for key, default in _DEFAULTS.items():
+            value = self.cache.setdefault(key, copy.deepcopy(default))
+            if isinstance(default, dict):
+                for field, field_default in default.items():
+                    value.setdefault(field, field_default)
+        # Seed the counters from the records once; from here on the mutators keep
+        # them current. total_threats is all-time, so it never drops below the
+        # stored value even though old threats get archived.
+        stats = self.cache["stats"]
+        stats["total_threats"] = max(stats["total_threats"], len(self.cache["threats"]))
+        stats["blocked_attacks"] = len(self.cache["firewall_rules"])
+        for section in _ID_SECTIONS.values():
+            for record in self.cache[section]:
+                _intern_fields(record)
+        for threat in self.cache["threats"]:
+            _set_epoch(threat)
+        for section in _KEYED_SECTIONS:
+            self._key_records(section)
+        for section in _BOUNDED_SECTIONS:
+            records = self.cache[section]
+            excess = len(records) - _MAX_RECORDS
+            if excess > 0:
+                self._overflow.extend((section, r) for r in list(records)[:excess])
+            self.cache[section] = deque(records, maxlen=_MAX_RECORDS)
+
+    def _key_records(self, section: str) -> None:
+        # Records from older stores may lack an id (or share one); keyed on it
+        # as-is they would collapse into one entry, so they get a fresh id
+        # from the counter, past every id already present
+        prefix = _SECTION_PREFIX[section]
+        records = self.cache[section]
+        self._counters[prefix] = max([self._counters.get(prefix, 0)] +
+                                     [_id_number(prefix, r.get("id")) for r in records])
+        keyed = {}
+        for record in records:
+            if record.get("id") is None or record["id"] in keyed:
+                record["id"] = self._next_id(prefix)
+            keyed[record["id"]] = record
+        self.cache[section] = keyed
 
-    def _save_to_file(self, data: Dict[str, Any]) -> bool:
+    def _append_bounded(self, section: str, record: Dict[str, Any], index: Optional[Dict[str, Any]] = None) -> None:
+        records = self.cache[section]
+        if len(records) == records.maxlen:
+            evicted = records[0]
+            self._overflow.append((section, evicted))
+            if index is not None:
+                index.pop(evicted.get("id"), None)
+        records.append(record)
+
+    def _archive(self, overflow: List[Tuple[str, Dict[str, Any]]]) -> None:
+        # Every call appends one gzip member; gzip readers treat them as one stream
+        lines = b"".join(_dumps({"section": section, "record": record}, newline=True) for section, record in overflow)
+        with gzip.open(self.archive_path, "ab") as f:
+            f.write(lines)
+
+    def _rebuild_indexes(self) -> None:
+        self._threats_by_id = {t.get("id"): t for t in self.cache["threats"]}
+        self._threats_by_source = {}
+        for t in self.cache["threats"]:
+            self._threats_by_source.setdefault(t.get("source"), {})[t.get("id")] = None
+        self._scans_by_id = {s.get("id"): s for s in self.cache["scans"]}
+        self._rules_by_ip = {r.get("source_ip"): rule_id for rule_id, r in self.cache["firewall_rules"].items()}
+
+    def _export(self, section: str, value: Any) -> Any:
+        return list(value.values()) if section in _KEYED_SECTIONS else value
+
+    def _seed_counters(self) -> None:
+        # Make sure no counter is behind an id already present, e.g. in a file
+        # written before counters were persisted or records replayed from the WAL.
+        for prefix, section in _ID_SECTIONS.items():
+            highest = self._counters.get(prefix, 0)
+            for record in self._export(section, self.cache[section]):
+                highest = max(highest, _id_number(prefix, record.get("id")))
+            self._counters[prefix] = highest
+
+    def _next_id(self, prefix: str) -> str:
+        # Callers must hold self._cache_lock
+        self._counters[prefix] = self._counters.get(prefix, 0) + 1
+        return f"{prefix}-{self._counters[prefix]}"
+
+    def _replay_wal(self) -> int:
+        replayed = 0
+        valid_end = 0  # Offset just past the last complete record
         try:
-            with self.lock:
-                with open(self.data_file_path, 'w') as f:
-                    json.dump(data, f, indent=2)
+            with open(self.wal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        # A record only counts once its newline made it to disk
+                        if not line.endswith(b"\n"):
+                            raise ValueError("missing record terminator")
+                        record = _loads(line)
+                    except ValueError:  # Includes JSONDecodeError
+                        logger.warning(f"Discarding torn record at offset {valid_end} of {self.wal_path}")
+                        # Cut it off so new appends do not get glued to the garbage
+                        os.ftruncate(self._wal_fd, valid_end)
+                        break
+                    valid_end += len(line)
+                    if record["seq"] <= self._wal_seq:
+                        continue  # Already contained in the checkpoint
+                    self._apply(record["op"], record["p"])
+                    self._wal_seq = record["seq"]
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        return replayed
+
+    def snapshot(self) -> Mapping[str, Any]:
+        """Return a read-only view of the live state without copying anything.
+
+        Sections are read-only views of the cache's own containers, so they
+        reflect later mutations: dict sections are mappings, and record sections
+        (threats, alerts, scans, firewall_rules) are sequences of read-only
+        records. Use load_data() when the caller needs a copy it can modify.
+        """
+        with self._cache_lock:
+            view = {}
+            for key, value in self.cache.items():
+                if key in _KEYED_SECTIONS:
+                    view[key] = _RecordsView(value.values())
+                elif isinstance(value, deque):
+                    view[key] = _RecordsView(value)
+                elif isinstance(value, dict):
+                    view[key] = MappingProxyType(value)
+                else:
+                    view[key] = value
+            return MappingProxyType(view)
+
+    def section_json(self, section: str) -> bytes:
+        """Compact JSON for one section, re-encoded only after the section changes."""
+        with self._cache_lock:
+            encoded = self._section_json.get(section)
+            if encoded is None:
+                encoded = self._section_json[section] = _dumps(self._export(section, self.cache[section]))
+            return encoded
+
+    def get_stats(self) -> Mapping[str, Any]:
+        """Return a read-only live view of the stats section."""
+        return MappingProxyType(self.cache["stats"])
+
+    def load_data(self, update_stats=True) -> Dict[str, Any]:
+        """Return a private copy of the in-memory state; never touches disk.
+
+        Read-only callers should prefer snapshot(), which does not copy.
+
+        ``update_stats`` is kept for existing callers: the threat and rule
+        counters are maintained by the mutators, so there is nothing to recompute.
+        """
+        with self._cache_lock:
+            if self._snapshot_version != self._version:
+                self._snapshot = b"{" + b",".join(self._section_parts()) + b"}"
+                self._snapshot_version = self._version
+            snapshot = self._snapshot
+        # Decoding the memoized bytes gives every caller its own copy, and is
+        # much cheaper than deep-copying the cache
+        return _loads(snapshot)
+
+    def save_data(self, data: Dict[str, Any]) -> bool:
+        """Replace the whole state and checkpoint it immediately."""
+        with self._cache_lock:
+            self.cache = copy.deepcopy(data)
+            self._section_bytes.clear()
+            self._section_json.clear()
+            self._version += 1
+            self._prepare_sections()
+            self._rebuild_indexes()
+            self._seed_counters()
+        return self._checkpoint()
+
+    def flush(self) -> bool:
+        """Checkpoint the cache if anything was logged since the last checkpoint."""
+        if not self._dirty.is_set():
             return True
-        except Exception as e:
-            logger.error(f"Error saving data: {str(e)}")
+        return self._checkpoint()
+
+    def _checkpoint_loop(self):
+        # Sleep until something is logged, then give the burst checkpoint_interval
+        # to settle so that any number of mutations costs a single checkpoint,
+        # unless the WAL grows past _WAL_COMPACT_RECORDS first.
+        while not self._stop.is_set():
+            self._dirty.wait()
+            self._wal_full.wait(self.checkpoint_interval)
+            self._wal_full.clear()
+            self.flush()
+
+    def _final_flush(self):
+        self._stop.set()
+        self._wal_full.set()  # Wakes the checkpoint loop so it can exit
+        self._drain_wal()
+        self.flush()
+
+    def _checkpoint(self) -> bool:
+        # The new state is written to a temporary file and synced before it
+        # replaces the data file, so a crash leaves either the old or the new
+        # checkpoint on disk, never a truncated one. Only the encode holds the
+        # cache lock; mutators keep logging to the WAL during the disk write.
+        tmp_path = self.data_file_path + ".tmp"
+        with self._io_lock:
+            try:
+                with self._wal_lock:
+                    with self._cache_lock:
+                        seq = self._wal_seq
+                        buf = self._encode_checkpoint(seq)
+                        self._wal_since_checkpoint = 0
+                        batch = self._take_pending()
+                        overflow, self._overflow = self._overflow, []
+                    # Once the batch is written everything up to seq is in the
+                    # WAL; later records will start at this offset
+                    self._write_wal(batch)
+                    wal_offset = os.lseek(self._wal_fd, 0, os.SEEK_END)
+                if self._compressor is not None:
+                    buf = self._compressor.compress(buf)
+                if overflow:
+                    # Archive before the checkpoint drops the records from the data file
+                    try:
+                        self._archive(overflow)
+                    except Exception:
+                        with self._cache_lock:
+                            self._overflow[:0] = overflow
+                        raise
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY, 0o644)
+                try:
+                    _write_all(fd, buf)
+                    _fdatasync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp_path, self.data_file_path)
+                with self._wal_lock:
+                    # Records logged during the write are newer than the checkpoint
+                    # and must survive; older ones are skipped on replay by seq.
+                    # Only the check takes the cache lock; the WAL rewrite holds
+                    # just _wal_lock, so mutators keep queueing records meanwhile
+                    with self._cache_lock:
+                        caught_up = self._wal_seq == seq
+                        if caught_up:
+                            self._dirty.clear()
+                    if caught_up:
+                        os.ftruncate(self._wal_fd, 0)
+                    else:
+                        self._compact_wal(wal_offset)
+                return True
+            except Exception as e:
+                logger.error(f"Error saving data: {str(e)}")
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                return False
+
+    def _compact_wal(self, offset: int) -> None:
+        # Callers must hold self._wal_lock, which keeps the file unchanged while
+        # it is copied; records still pending are written to the new file later.
+        # Keeps only the records written after offset, so under sustained load
+        # the WAL is still cut back at every checkpoint instead of growing until
+        # a quiet moment.
+        with open(self.wal_path, "rb") as f:
+            f.seek(offset)
+            tail = f.read()
+        tmp_path = self.wal_path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY, 0o644)
+        try:
+            _write_all(fd, tail)
+            _fdatasync(fd)
+        finally:
+            os.close(fd)
+        # Closed before the replace, which Windows refuses on an open file
+        os.close(self._wal_fd)
+        os.replace(tmp_path, self.wal_path)
+        self._wal_fd = os.open(self.wal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | _O_BINARY, 0o644)
+
+    def _section_parts(self) -> List[bytes]:
+        # Callers must hold self._cache_lock. Sections untouched since they were
+        # last encoded reuse their cached bytes, so e.g. a health update does not
+        # re-encode the whole threat history.
+        parts = []
+        for key, value in self.cache.items():
+            fragment = self._section_bytes.get(key)
+            if fragment is None:
+                fragment = self._section_bytes[key] = _dumps(self._export(key, value), indent=True)
+            parts.append(_dumps(key) + b": " + fragment)
+        return parts
+
+    def _encode_checkpoint(self, seq: int) -> bytes:
+        # Callers must hold self._cache_lock
+        parts = self._section_parts()
+        parts.append(b'"_counters": ' + _dumps(self._counters))
+        parts.append(b'"_wal_seq": ' + str(seq).encode())
+        return b"{\n" + b",\n".join(parts) + b"\n}\n"
+
+    def _append_wal(self, op: str, payload: Any) -> None:
+        # Callers must hold self._cache_lock
+        self._wal_seq += 1
+        self._dirty.set()
+        self._wal_since_checkpoint += 1
+        if self._wal_since_checkpoint >= _WAL_COMPACT_RECORDS:
+            self._wal_full.set()
+        self._wal_pending.append(_dumps({"seq": self._wal_seq, "op": op, "p": payload}, newline=True))
+        # Mutators never touch the disk; the writer thread commits the batch
+        self._wal_ready.set()
+        if len(self._wal_pending) >= _WAL_BATCH_RECORDS:
+            self._wal_batch.set()
+
+    def _take_pending(self) -> bytes:
+        # Callers must hold self._cache_lock
+        self._wal_ready.clear()
+        batch = b"".join(self._wal_pending)
+        self._wal_pending.clear()
+        return batch
+
+    def _write_wal(self, batch: bytes) -> None:
+        # Callers must hold self._wal_lock. One write and one fdatasync per group
+        # commit; only a synced record survives a power failure or host crash.
+        if not batch:
+            return
+        try:
+            _write_all(self._wal_fd, batch)
+            _fdatasync(self._wal_fd)
+        except OSError as e:
+            # The changes are still in the cache and go out with the next checkpoint
+            logger.error(f"Error appending to {self.wal_path}: {str(e)}")
+
+    def _drain_wal(self) -> None:
+        # Callers must not hold self._cache_lock: the write and sync run with
+        # only self._wal_lock held, so mutators keep going meanwhile
+        with self._wal_lock:
+            with self._cache_lock:
+                batch = self._take_pending()
+            self._write_wal(batch)
+
+    def _wal_writer_loop(self):
+        while not self._stop.is_set():
+            self._wal_ready.wait()
+            self._wal_batch.wait(_WAL_GROUP_COMMIT_DELAY)
+            self._wal_batch.clear()
+            self._drain_wal()
+
+    def _apply(self, op: str, payload: Any) -> bool:
+        if not getattr(self, f"_apply_{op}")(payload):
             return False
+        for section in _OP_SECTIONS[op]:
+            self._section_bytes.pop(section, None)
+            self._section_json.pop(section, None)
+        self._version += 1
+        return True
+
+    def _commit(self, op: str, payload: Any) -> bool:
+        # Callers must hold self._cache_lock
+        if not self._apply(op, payload):
+            return False
+        self._append_wal(op, payload)
+        return True
+
+    def _bump_stat(self, key: str, delta: int) -> None:
+        self.cache["stats"][key] += delta
 
     def update_stats(self, stats: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        data["stats"] = {**data.get("stats", {}), **stats}
-        return self.save_data(data)
+        with self._cache_lock:
+            current = self.cache["stats"]
+            changed = {k: v for k, v in stats.items() if current.get(k, _MISSING) != v}
+            if not changed:
+                # Nothing to log: polling callers would otherwise dirty the
+                # checkpoint on every request
+                return True
+            return self._commit("update_stats", changed)
+
+    def _apply_update_stats(self, stats: Dict[str, Any]) -> bool:
+        self.cache["stats"].update(stats)
+        return True
 
     def add_threat(self, threat: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        if "timestamp" not in threat:
-            threat["timestamp"] = datetime.now().isoformat()
-        if "id" not in threat:
-            threat["id"] = f"threat-{len(data.get('threats', [])) + 1}"
-
-        threats = data.get("threats", [])
-        if not any(t["id"] == threat["id"] for t in threats):
-            threats.append(threat)
-            data["threats"] = threats
-            return self.save_data(data)
-        return False
+        with self._cache_lock:
+            if "timestamp" not in threat:
+                now = datetime.now()
+                threat["timestamp"] = now.isoformat()
+                threat.setdefault("ts_epoch", now.timestamp())
+            if "id" not in threat:
+                threat["id"] = self._next_id("threat")
+            return self._commit("add_threat", threat)
+
+    def _apply_add_threat(self, threat: Dict[str, Any]) -> bool:
+        if threat["id"] in self._threats_by_id:
+            return False
+        _intern_fields(threat)
+        _set_epoch(threat)  # WAL records written before ts_epoch existed
+        threats = self.cache["threats"]
+        if len(threats) == threats.maxlen:
+            self._unindex_source(threats[0])
+        self._append_bounded("threats", threat, self._threats_by_id)
+        self._threats_by_id[threat["id"]] = threat
+        self._threats_by_source.setdefault(threat.get("source"), {})[threat["id"]] = None
+        self._bump_stat("total_threats", 1)
+        return True
 
     def update_threat(self, threat_id: str, updates: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        threats = data.get("threats", [])
-        for i, threat in enumerate(threats):
-            if threat.get("id") == threat_id:
-                threats[i] = {**threat, **updates}
-                data["threats"] = threats
-                return self.save_data(data)
-        return False
+        with self._cache_lock:
+            threat = self._threats_by_id.get(threat_id)
+            if threat is not None and not _changes(threat, updates):
+                return True  # Nothing to log
+            return self._commit("update_threat", {"id": threat_id, "updates": updates})
+
+    def update_threats_by_source(self, source_ip: str, updates: Dict[str, Any]) -> List[str]:
+        """Apply updates to every retained threat from source_ip with a single WAL record.
+
+        Threats the updates would not change are skipped. Returns the ids of
+        the threats changed, oldest first.
+        """
+        with self._cache_lock:
+            ids = [threat_id for threat_id in self._threats_by_source.get(source_ip, ())
+                   if _changes(self._threats_by_id[threat_id], updates)]
+            if ids:
+                self._commit("update_threats", {"ids": ids, "updates": updates})
+            return ids
+
+    def _apply_update_threats(self, payload: Dict[str, Any]) -> bool:
+        updated = [self._apply_update_threat({"id": threat_id, "updates": payload["updates"]})
+                   for threat_id in payload["ids"]]
+        return any(updated)
+
+    def _apply_update_threat(self, payload: Dict[str, Any]) -> bool:
+        threat = self._threats_by_id.get(payload["id"])
+        if threat is None:
+            return False
+        source = threat.get("source")
+        threat.update(payload["updates"])
+        _intern_fields(threat)
+        if threat.get("source") != source:
+            self._unindex_source({"source": source, "id": threat["id"]})
+            self._threats_by_source.setdefault(threat.get("source"), {})[threat["id"]] = None
+        return True
+
+    def _unindex_source(self, threat: Dict[str, Any]) -> None:
+        ids = self._threats_by_source.get(threat.get("source"))
+        if ids and threat.get("id") in ids:
+            del ids[threat.get("id")]
+            if not ids:
+                del self._threats_by_source[threat.get("source")]
+
+    def get_threat(self, threat_id: str) -> Optional[Mapping[str, Any]]:
+        with self._cache_lock:
+            threat = self._threats_by_id.get(threat_id)
+            return MappingProxyType(threat) if threat is not None else None
+
+    def recent_threats(self, limit: int) -> List[Dict[str, Any]]:
+        """Copies of the newest ``limit`` threats by timestamp, newest first.
+
+        Threats are kept in the order they were added, which can trail their
+        timestamps by the ML round-trip, so only a short tail is ranked
+        instead of sorting the whole section.
+        """
+        with self._cache_lock:
+            tail = islice(reversed(self.cache["threats"]), limit + _REORDER_WINDOW)
+            return [dict(t) for t in heapq.nlargest(limit, tail, key=_epoch_of)]
+
+    def recent_threats_json(self, limit: int) -> bytes:
+        """recent_threats(limit) as compact JSON, re-encoded only after a change."""
+        with self._cache_lock:
+            version, cached_limit, encoded = self._recent_json
+            if version != self._version or cached_limit != limit:
+                tail = islice(reversed(self.cache["threats"]), limit + _REORDER_WINDOW)
+                encoded = _dumps(heapq.nlargest(limit, tail, key=_epoch_of))
+                self._recent_json = (self._version, limit, encoded)
+            return encoded
+
+    def threats_since(self, epoch: float) -> List[Dict[str, Any]]:
+        """Copies of the threats stamped after ``epoch`` (seconds), latest added first.
+
+        Walks back from the newest record, so the cost follows the result
+        size rather than the section size. The section is only nearly sorted
+        (see _REORDER_WINDOW), so the walk continues that far past the cutoff
+        instead of bisecting or stopping at the first older record.
+        """
+        # Compared on ts_epoch: the ISO "timestamp" is naive local time, which
+        # repeats an hour when DST ends and is kept for display only
+        newer = []
+        older = 0
+        with self._cache_lock:
+            for t in reversed(self.cache["threats"]):
+                if t.get("ts_epoch", 0.0) > epoch:
+                    newer.append(dict(t))
+                else:
+                    older += 1
+                    if older > _REORDER_WINDOW:
+                        break
+        return newer
+
+    def threat_ids_by_source(self, source_ip: str) -> List[str]:
+        """Ids of the retained threats from source_ip, oldest first."""
+        with self._cache_lock:
+            return list(self._threats_by_source.get(source_ip, ()))
 
     def add_firewall_rule(self, rule: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        if "timestamp" not in rule:
-            rule["timestamp"] = datetime.now().isoformat()
-        if "id" not in rule:
-            rule["id"] = f"rule-{len(data.get('firewall_rules', [])) + 1}"
-
-        rules = data.get("firewall_rules", [])
-        if not any(r["source_ip"] == rule["source_ip"] for r in rules):
-            rules.append(rule)
-            data["firewall_rules"] = rules
-            return self.save_data(data)
-        return False
+        with self._cache_lock:
+            if "timestamp" not in rule:
+                rule["timestamp"] = datetime.now().isoformat()
+            if "id" not in rule:
+                rule["id"] = self._next_id("rule")
+            return self._commit("add_firewall_rule", rule)
+
+    def _apply_add_firewall_rule(self, rule: Dict[str, Any]) -> bool:
+        rules = self.cache["firewall_rules"]
+        if rule["source_ip"] in self._rules_by_ip or rule["id"] in rules:
+            return False
+        _intern_fields(rule)
+        rules[rule["id"]] = rule
+        self._rules_by_ip[rule["source_ip"]] = rule["id"]
+        self._bump_stat("blocked_attacks", 1)
+        return True
+
+    def add_firewall_rules(self, rules: List[Dict[str, Any]]) -> bool:
+        """Add several rules with a single WAL record."""
+        with self._cache_lock:
+            for rule in rules:
+                if "timestamp" not in rule:
+                    rule["timestamp"] = datetime.now().isoformat()
+                if "id" not in rule:
+                    rule["id"] = self._next_id("rule")
+            return self._commit("add_firewall_rules", rules)
+
+    def _apply_add_firewall_rules(self, rules: List[Dict[str, Any]]) -> bool:
+        added = [self._apply_add_firewall_rule(rule) for rule in rules]
+        return any(added)
+
+    def get_firewall_rule(self, rule_id_or_ip: str) -> Optional[Mapping[str, Any]]:
+        """Look up a rule by id or source IP without copying the ruleset."""
+        with self._cache_lock:
+            rules = self.cache["firewall_rules"]
+            rule = rules.get(rule_id_or_ip)
+            if rule is None:
+                rule = rules.get(self._rules_by_ip.get(rule_id_or_ip))
+            return MappingProxyType(rule) if rule is not None else None
 
     def remove_firewall_rule(self, rule_id_or_ip: str) -> bool:
-        data = self.load_data(update_stats=False)
-        rules = data.get("firewall_rules", [])
-        for i, rule in enumerate(rules):
-            if rule.get("id") == rule_id_or_ip or rule.get("source_ip") == rule_id_or_ip:
-                rules.pop(i)
-                data["firewall_rules"] = rules
-                return self.save_data(data)
-        return False
+        with self._cache_lock:
+            return self._commit("remove_firewall_rule", rule_id_or_ip)
+
+    def _apply_remove_firewall_rule(self, rule_id_or_ip: str) -> bool:
+        rules = self.cache["firewall_rules"]
+        rule_id = rule_id_or_ip if rule_id_or_ip in rules else self._rules_by_ip.get(rule_id_or_ip)
+        if rule_id is None:
+            return False
+        rule = rules.pop(rule_id)
+        self._rules_by_ip.pop(rule.get("source_ip"), None)
+        self._bump_stat("blocked_attacks", -1)
+        return True
+
+    def remove_firewall_rules(self, rule_ids_or_ips: List[str]) -> bool:
+        """Remove several rules with a single WAL record."""
+        with self._cache_lock:
+            return self._commit("remove_firewall_rules", rule_ids_or_ips)
+
+    def _apply_remove_firewall_rules(self, rule_ids_or_ips: List[str]) -> bool:
+        removed = [self._apply_remove_firewall_rule(key) for key in rule_ids_or_ips]
+        return any(removed)
 
     def add_alert(self, alert: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        if "timestamp" not in alert:
-            alert["timestamp"] = datetime.now().isoformat()
-        if "id" not in alert:
-            alert["id"] = f"alert-{len(data.get('alerts', [])) + 1}"
+        with self._cache_lock:
+            if "timestamp" not in alert:
+                alert["timestamp"] = datetime.now().isoformat()
+            if "id" not in alert:
+                alert["id"] = self._next_id("alert")
+            return self._commit("add_alert", alert)
 
-        alerts = data.get("alerts", [])
-        alerts.append(alert)
-        data["alerts"] = alerts
-        return self.save_data(data)
+    def _apply_add_alert(self, alert: Dict[str, Any]) -> bool:
+        _intern_fields(alert)
+        self._append_bounded("alerts", alert)
+        return True
 
     def update_system_health(self, health_data: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        data["system_health"] = {**data.get("system_health", {}), **health_data}
-        return self.save_data(data)
+        with self._cache_lock:
+            return self._commit("update_system_health", health_data)
+
+    def _apply_update_system_health(self, health_data: Dict[str, Any]) -> bool:
+        self.cache["system_health"].update(health_data)
+        return True
 
     def add_scan(self, scan: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        if "timestamp" not in scan:
-            scan["timestamp"] = datetime.now().isoformat()
-        if "id" not in scan:
-            scan["id"] = f"scan-{len(data.get('scans', [])) + 1}"
+        with self._cache_lock:
+            if "timestamp" not in scan:
+                scan["timestamp"] = datetime.now().isoformat()
+            if "id" not in scan:
+                scan["id"] = self._next_id("scan")
+            return self._commit("add_scan", scan)
 
-        scans = data.get("scans", [])
-        scans.append(scan)
-        data["scans"] = scans
-        return self.save_data(data)
+    def _apply_add_scan(self, scan: Dict[str, Any]) -> bool:
+        _intern_fields(scan)
+        self._append_bounded("scans", scan, self._scans_by_id)
+        self._scans_by_id[scan["id"]] = scan
+        return True
 
     def update_scan(self, scan_id: str, updates: Dict[str, Any]) -> bool:
-        data = self.load_data(update_stats=False)
-        scans = data.get("scans", [])
-        for i, scan in enumerate(scans):
-            if scan.get("id") == scan_id:
-                scans[i] = {**scan, **updates}
-                data["scans"] = scans
-                return self.save_data(data)
-        return False
\ No newline at end of file
+        with self._cache_lock:
+            return self._commit("update_scan", {"id": scan_id, "updates": updates})
+
+    def _apply_update_scan(self, payload: Dict[str, Any]) -> bool:
+        scan = self._scans_by_id.get(payload["id"])
+        if scan is None:
+            return False
+        scan.update(payload["updates"])
+        _intern_fields(scan)
+        return True
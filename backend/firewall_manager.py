@@ -1,40 +1,338 @@
+import ipaddress
 import logging
+import os
+import re
+import select
+import shlex
+import shutil
+import signal
 import subprocess
-import random
+import threading
 import time
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional, Set, Tuple
 from datetime import datetime
 
 logger = logging.getLogger("firewall-manager")
 
+_SENTINEL = "__END__"
+# Block/allow lists live in two ipsets, each matched by a single iptables rule,
+# so a packet is checked with a hash lookup instead of a walk over per-IP rules.
+# hash:net rather than hash:ip keeps CIDR sources working as they did with -s.
+_BLOCK_SET = "idsblock"
+_ALLOW_SET = "idsallow"
+_SET_TYPE = "hash:net"
+_TARGET_SET = {"DROP": _BLOCK_SET, "ACCEPT": _ALLOW_SET}
+_SET_TARGET = {_BLOCK_SET: "DROP", _ALLOW_SET: "ACCEPT"}
+_SET_RULES = [
+    f"-A INPUT -m set --match-set {_ALLOW_SET} src -j ACCEPT",
+    f"-A INPUT -m set --match-set {_BLOCK_SET} src -j DROP",
+]
+_ACTION_TARGET = {"block": "DROP", "drop": "DROP", "allow": "ACCEPT", "accept": "ACCEPT"}
+_NORMALIZED = {"block": "block", "drop": "block", "allow": "allow", "accept": "allow"}
+_CONFLICT = {"block": "allow", "allow": "block"}
+_MEMBER_RE = re.compile(rf"^add ({_BLOCK_SET}|{_ALLOW_SET}) (\S+)", re.MULTILINE)
+
+# Wait up to 2 s for the xtables lock, polling every 50 ms, instead of failing fast
+_LOCK_WAIT = ["-w", "2", "-W", "50000"]
+_RETRY_BACKOFF = (0.02, 0.05, 0.1, 0.25)
+_FATAL_ERRORS = ("No chain/target/match by that name", "Bad argument")
+# Longest a single command may take before its session is killed; a wedged
+# iptables/ipset call must not hold the shell lock (and every caller) forever
+_COMMAND_TIMEOUT = 10.0
+
+_ts_cache = [0, ""]
+
+def _now_iso() -> str:
+    # Timestamps have one-second resolution; reformat only when the second changes
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache[1] = datetime.fromtimestamp(now).isoformat()
+        _ts_cache[0] = now
+    return _ts_cache[1]
+
+def normalize_source_ip(value: str) -> str:
+    """Return an IPv4 address or CIDR block in the form ipset lists it.
+
+    Raises ValueError for anything else, including values with whitespace
+    or line breaks, which would otherwise split a restore batch line.
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"{value!r} is not an IPv4 address or network")
+    network = ipaddress.ip_network(value, strict=False)
+    if network.version != 4:
+        raise ValueError(f"{value!r} is not an IPv4 address or network")
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+def _set_rule_fixes(current: List[str]) -> List[str]:
+    """iptables-restore lines that leave the set-match rules in INPUT, allow before block.
+
+    current is the chain as iptables -S lists it. When a rule is missing or
+    they are out of order, both go to the head of the chain; appending the
+    missing one could put allow after block, so allow-listed addresses in a
+    blocked range would stay blocked.
+    """
+    positions = [current.index(spec) if spec in current else -1 for spec in _SET_RULES]
+    if -1 not in positions and positions == sorted(positions):
+        return []
+    lines = ["-D" + spec[2:] for spec in _SET_RULES if spec in current]
+    lines += [f"-I INPUT {n}{spec[len('-A INPUT'):]}" for n, spec in enumerate(_SET_RULES, 1)]
+    return lines
+
+def _has_line_break(lines: List[str]) -> bool:
+    return any("\n" in line or "\r" in line for line in lines)
+
 class FirewallManager:
     def __init__(self, data_manager, container_name: str = "demo_firewall"):
         self.data_manager = data_manager
         self.container_name = container_name
-        self._check_container_status()
+        self._sh: Optional[subprocess.Popen] = None
+        self._sh_buf = b""  # Shell output read past the last returned line
+        self._sh_lock = threading.Lock()
+        self._verified = False
+        self._netns_pid: Optional[int] = None
+        self._netns_fd: Optional[int] = None  # Held open on the container's netns while _netns_pid is set
+        self._use_nsenter = True
+        self._open_shell()
+        self._ensure_sets()
+        self._rules_cache: Set[Tuple[str, str]] = set()
+        self._sync_rules_cache()
+
+    def _inspect_pid(self) -> str:
+        result = subprocess.run(
+            ["docker", "inspect", "-f", "{{.State.Pid}} {{.State.StartedAt}}", self.container_name],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        return result.stdout.strip()
+
+    def _open_netns(self) -> None:
+        # nsenter needs root and the iptables/ipset binaries on the host; without
+        # them the shell goes through docker exec and this lookup is skipped.
+        if getattr(os, "geteuid", lambda: -1)() != 0 or not all(shutil.which(tool) for tool in ("nsenter", "iptables", "ipset")):
+            return
+        try:
+            state = self._inspect_pid()
+            pid = int(state.split()[0])
+            if not pid:
+                raise ValueError(f"'{self.container_name}' is not running")
+            fd = os.open(f"/proc/{pid}/ns/net", os.O_RDONLY)
+        except (subprocess.CalledProcessError, ValueError, IndexError, OSError) as e:
+            logger.warning(f"Cannot resolve PID of '{self.container_name}', using docker exec: {str(e)}")
+            return
+        # The PID could have been reused between the inspect and the open; the
+        # container's PID and start time must be unchanged afterwards
+        try:
+            unchanged = self._inspect_pid() == state
+        except subprocess.CalledProcessError:
+            unchanged = False
+        if not unchanged:
+            os.close(fd)
+            logger.warning(f"'{self.container_name}' restarted while resolving its PID, using docker exec")
+            return
+        self._netns_pid, self._netns_fd = pid, fd
+
+    def _close_netns(self) -> None:
+        if self._netns_fd is not None:
+            os.close(self._netns_fd)
+        self._netns_pid = self._netns_fd = None
+
+    def _netns_changed(self) -> bool:
+        # The held descriptor keeps the namespace it was opened on alive, so it
+        # can't be confused with a new one; /proc/<pid> belongs to whatever
+        # process has that PID now (after a container restart, possibly a host one)
+        try:
+            current = os.stat(f"/proc/{self._netns_pid}/ns/net")
+        except OSError:
+            return True
+        held = os.fstat(self._netns_fd)
+        return (current.st_dev, current.st_ino) != (held.st_dev, held.st_ino)
+
+    def _exec_prefix(self) -> List[str]:
+        # How a command is run inside the container's network namespace. nsenter
+        # joins the namespace through the held descriptor, never by PID.
+        if self._netns_fd is not None:
+            return ["nsenter", f"--net=/proc/self/fd/{self._netns_fd}"]
+        return ["docker", "exec", "-i", self.container_name]
+
+    def _pass_fds(self) -> Tuple[int, ...]:
+        return (self._netns_fd,) if self._netns_fd is not None else ()
 
-    def _check_container_status(self) -> None:
+    def _open_shell(self) -> None:
+        # One long-lived shell; every iptables call is streamed to it instead of
+        # paying a fresh docker exec attach. When possible the shell joins the
+        # container's network namespace directly, bypassing dockerd altogether.
+        self._close_netns()
+        if self._use_nsenter:
+            self._open_netns()
+        # Its own session, so a timeout can kill the shell together with the
+        # command it is stuck on
+        self._sh = subprocess.Popen(
+            self._exec_prefix() + ["sh"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            pass_fds=self._pass_fds()
+        )
+        self._sh_buf = b""
+
+    def _kill_shell(self) -> None:
+        # Callers must hold self._sh_lock. The next command opens a fresh session.
+        sh, self._sh = self._sh, None
+        if sh is None:
+            return
+        try:
+            os.killpg(sh.pid, signal.SIGKILL)
+        except (AttributeError, OSError):  # killpg is POSIX-only
+            sh.kill()
+        try:
+            sh.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+
+    def flush(self) -> bool:
+        """Checkpoint rule changes now instead of at the data store's next background checkpoint."""
+        return self.data_manager.flush()
+
+    def close(self) -> None:
+        self.flush()
+        with self._sh_lock:
+            sh, self._sh = self._sh, None
+            self._close_netns()
+            if sh is None or sh.poll() is not None:
+                return
+            try:
+                sh.stdin.write(b"exit\n")
+                sh.stdin.close()
+                sh.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                sh.kill()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _sh_run(self, command: List[str], input: Optional[str] = None, quiet: bool = False,
+                on_line: Optional[Callable[[str], bool]] = None) -> Tuple[int, str]:
+        """Run a command in the container and return (returncode, combined output).
+
+        Commands without input go through the persistent shell. Input (an
+        iptables-restore or ipset restore batch) is never pasted into the shell
+        script; the command then runs as its own process with the input on its
+        stdin, so no line of it can be read by the shell.
+
+        quiet discards the command's stdout, so only its stderr is returned.
+        on_line sees each line as it is read; lines it returns True for are
+        consumed and left out of the returned output.
+        """
+        # Each argument is quoted, but the shell still reads one command per
+        # line; nothing legitimate passes a line break as an argument
+        if any("\n" in arg or "\r" in arg for arg in command):
+            return -1, f"Refusing command with a line break in an argument: {command!r}"
+        with self._sh_lock:
+            if self._sh is not None and self._netns_fd is not None and self._netns_changed():
+                # The container restarted; the old namespace is no longer the firewall's
+                logger.warning(f"Network namespace of '{self.container_name}' changed, re-resolving it")
+                self._kill_shell()
+            if self._sh is None or self._sh.poll() is not None:
+                self._open_shell()
+            if input is not None:
+                returncode, output = self._run_with_input(command, input, quiet)
+            else:
+                returncode, output = self._run_in_shell(command, quiet, on_line)
+            if returncode == 0 or self._netns_pid is None or "nsenter:" not in output:
+                return returncode, output
+            logger.warning(f"nsenter unavailable, falling back to docker exec: {output.strip()}")
+            self._use_nsenter = False
+            self._kill_shell()
+        return self._sh_run(command, input, quiet, on_line)
+
+    def _run_with_input(self, command: List[str], input: str, quiet: bool) -> Tuple[int, str]:
+        # Callers must hold self._sh_lock
         try:
             result = subprocess.run(
-                ["docker", "inspect", "-f", "{{.State.Running}}", self.container_name],
-                capture_output=True,
+                self._exec_prefix() + command,
+                input=input,
+                stdout=subprocess.DEVNULL if quiet else subprocess.PIPE,
+                stderr=subprocess.PIPE if quiet else subprocess.STDOUT,
                 text=True,
-                check=True
+                timeout=_COMMAND_TIMEOUT,
+                pass_fds=self._pass_fds()
             )
-            if result.stdout.strip() != "true":
-                logger.error(f"Container '{self.container_name}' is not running.")
-                raise RuntimeError(f"Container '{self.container_name}' is not running.")
-            logger.info(f"Container '{self.container_name}' is running.")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to check container status: {str(e)}")
-            raise RuntimeError(f"Cannot access container '{self.container_name}': {str(e)}")
+        except subprocess.TimeoutExpired:
+            return -1, f"{command[0]} timed out after {_COMMAND_TIMEOUT:g} s"
+        except OSError as e:
+            return -1, str(e)
+        return result.returncode, (result.stderr if quiet else result.stdout) or ""
+
+    def _run_in_shell(self, command: List[str], quiet: bool,
+                      on_line: Optional[Callable[[str], bool]]) -> Tuple[int, str]:
+        # Callers must hold self._sh_lock
+        line = " ".join(shlex.quote(arg) for arg in command)
+        if quiet:
+            line += " >/dev/null"
+        sh = self._sh
+        output = []
+        deadline = time.monotonic() + _COMMAND_TIMEOUT
+        try:
+            sh.stdin.write(f"{{\n{line}\n}} 2>&1; echo {_SENTINEL}$?\n".encode())
+            sh.stdin.flush()
+            while True:
+                out = self._read_line(sh.stdout.fileno(), deadline)
+                head, sep, rc = out.partition(_SENTINEL)
+                if sep:
+                    if head and (on_line is None or not on_line(head)):
+                        output.append(head)
+                    return int(rc.strip()), "".join(output)
+                if on_line is None or not on_line(out):
+                    output.append(out)
+        except (OSError, ValueError) as e:  # Includes the TimeoutError from _read_line
+            # Drop the broken session; the next call opens a fresh one.
+            output.append(self._sh_buf.decode(errors="replace"))
+            self._kill_shell()
+            return -1, f"{e}: {''.join(output).strip()}"
+
+    def _read_line(self, fd: int, deadline: float) -> str:
+        # Callers must hold self._sh_lock. The pipe is read directly rather than
+        # through a buffered readline, so select() never misses pending output.
+        while True:
+            end = self._sh_buf.find(b"\n") + 1
+            if end:
+                line, self._sh_buf = self._sh_buf[:end], self._sh_buf[end:]
+                return line.decode(errors="replace")
+            ready, _, _ = select.select([fd], [], [], max(0.0, deadline - time.monotonic()))
+            if not ready:
+                raise TimeoutError(f"no reply within {_COMMAND_TIMEOUT:g} s")
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise OSError("container shell exited")
+            self._sh_buf += chunk
+
+    def _sh_check(self, command: List[str], input: Optional[str] = None, quiet: bool = False,
+                  on_line: Optional[Callable[[str], bool]] = None) -> str:
+        returncode, output = self._sh_run(command, input, quiet, on_line)
+        if returncode == 0:
+            self._verified = True
+        elif not self._verified and ("No such container" in output or "is not running" in output):
+            # The container is validated by the first real command instead of
+            # a separate docker inspect at startup.
+            logger.error(f"Container '{self.container_name}' is not available: {output.strip()}")
+            raise RuntimeError(f"Cannot access container '{self.container_name}': {output.strip()}")
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, output=output, stderr=output)
+        return output
 
     def _execute_iptables_command(self, command: List[str], retries=3) -> bool:
-        docker_cmd = ["docker", "exec", self.container_name, "iptables"] + command
+        iptables_cmd = ["iptables"] + _LOCK_WAIT + command
         for attempt in range(retries):
             try:
-                result = subprocess.run(docker_cmd, check=True, capture_output=True, text=True)
-                logger.info(f"Executed iptables command: {' '.join(docker_cmd)}")
+                self._sh_check(iptables_cmd, quiet=True)
+                logger.info(f"Executed iptables command: {' '.join(iptables_cmd)}")
                 return True
             except subprocess.CalledProcessError as e:
                 logger.error(f"Attempt {attempt + 1} failed: {str(e)} - {e.stderr}")
@@ -42,59 +340,108 @@ class FirewallManager:
                     if "-D" in command:
                         logger.info(f"No rule to delete in iptables for {command}, treating as success")
                         return True
+                if any(error in e.stderr for error in _FATAL_ERRORS):
+                    return False
                 if attempt + 1 == retries:
                     return False
-                time.sleep(1)
+                time.sleep(_RETRY_BACKOFF[min(attempt, len(_RETRY_BACKOFF) - 1)])
         return False
 
-    def _rule_exists(self, source_ip: str, action: str) -> bool:
-        try:
-            result = subprocess.run(
-                ["docker", "exec", self.container_name, "iptables", "-L", "INPUT", "-n", "--line-numbers"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            target = "ACCEPT" if action in ("allow", "accept") else "DROP"
-            for line in result.stdout.splitlines():
-                if source_ip in line and target in line and not line.startswith("Chain") and not line.startswith("num"):
-                    return True
+    def _ensure_sets(self) -> None:
+        if self._ipset_restore([f"create {name} {_SET_TYPE}" for name in (_ALLOW_SET, _BLOCK_SET)]):
+            self._ensure_set_rules()
+
+    def _input_rules(self) -> Optional[List[str]]:
+        """The INPUT chain's rules as iptables -S lists them, or None if it cannot be read."""
+        current = []
+
+        def collect(line: str) -> bool:
+            if line.startswith("-"):
+                if line.startswith("-A "):
+                    current.append(line.rstrip("\n"))
+                return True
             return False
+
+        try:
+            self._sh_check(["iptables", "-S", "INPUT"], on_line=collect)
         except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to check existing rules: {str(e)}")
+            logger.error(f"Failed to read INPUT chain: {str(e)}")
+            return None
+        return current
+
+    def _ensure_set_rules(self) -> bool:
+        """Make sure INPUT has the set-match rules, allow before block, leaving other rules alone.
+
+        Runs at construction; only apply_rules reconciles the whole chain.
+        """
+        current = self._input_rules()
+        if current is None:
+            return False
+        lines = _set_rule_fixes(current)
+        return not lines or self._restore(lines)
+
+    def _sync_chain(self) -> bool:
+        """Bring INPUT to exactly the set-match rules, allow before block, touching only the rules that differ."""
+        current = self._input_rules()
+        if current is None:
             return False
+        lines = ["-D" + line[2:] for line in current if line not in _SET_RULES]
+        lines += _set_rule_fixes(current)
+        return not lines or self._restore(lines)
+
+    def _read_members(self) -> Set[Tuple[str, str]]:
+        # Members are parsed as the lines stream in rather than from one big string
+        members = set()
+
+        def collect(line: str) -> bool:
+            match = _MEMBER_RE.match(line)
+            if match is not None:
+                members.add((match.group(2), _SET_TARGET[match.group(1)]))
+                return True
+            return line.startswith("create ")
+
+        self._sh_check(["ipset", "save"], on_line=collect)
+        return members
+
+    def _sync_rules_cache(self) -> None:
+        try:
+            self._rules_cache = self._read_members()
+            logger.info(f"Loaded {len(self._rules_cache)} block/allow entries from ipset")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to read existing rules: {str(e)}")
+
+    def _rule_exists(self, source_ip: str, action: str) -> bool:
+        return (source_ip, _ACTION_TARGET[action]) in self._rules_cache
 
     def _remove_conflicting_rule(self, source_ip: str, conflicting_action: str) -> bool:
-        conflicting_target = "ACCEPT" if conflicting_action in ("allow", "accept") else "DROP"
-        iptables_cmd = ["-D", "INPUT", "-s", source_ip, "-j", conflicting_target]
-        return self._execute_iptables_command(iptables_cmd)
+        conflicting_target = _ACTION_TARGET[conflicting_action]
+        if not self._ipset_restore([f"del {_TARGET_SET[conflicting_target]} {source_ip}"]):
+            return False
+        self._rules_cache.discard((source_ip, conflicting_target))
+        return True
 
     def get_rules(self) -> List[Dict[str, Any]]:
-        data = self.data_manager.load_data(update_stats=False)
-        return data.get("firewall_rules", [])
+        return list(self.data_manager.snapshot()["firewall_rules"])
 
     def add_rule(self, rule: Dict[str, Any]) -> bool:
         if "source_ip" not in rule or "action" not in rule:
             logger.error("Invalid firewall rule: missing required fields")
             return False
+        try:
+            rule["source_ip"] = normalize_source_ip(rule["source_ip"])
+        except ValueError as e:
+            logger.error(f"Invalid firewall rule: {str(e)}")
+            return False
 
         if "timestamp" not in rule:
-            rule["timestamp"] = datetime.now().isoformat()
-        if "id" not in rule:
-            rule["id"] = f"rule-{random.randint(1000, 9999)}"
-
-        action = rule["action"].lower()
-        if action in ("block", "drop"):
-            iptables_cmd = ["-A", "INPUT", "-s", rule["source_ip"], "-j", "DROP"]
-            normalized_action = "block"
-            conflicting_action = "allow"
-        elif action in ("allow", "accept"):
-            iptables_cmd = ["-A", "INPUT", "-s", rule["source_ip"], "-j", "ACCEPT"]
-            normalized_action = "allow"
-            conflicting_action = "block"
-        else:
+            rule["timestamp"] = _now_iso()
+
+        normalized_action = _NORMALIZED.get(rule["action"].lower())
+        if normalized_action is None:
             logger.error(f"Unsupported action: {rule['action']}")
             return False
+        target = _ACTION_TARGET[normalized_action]
+        conflicting_action = _CONFLICT[normalized_action]
 
         if self._rule_exists(rule["source_ip"], conflicting_action):
             logger.info(f"Removing conflicting {conflicting_action} rule for {rule['source_ip']}")
@@ -107,10 +454,11 @@ class FirewallManager:
             logger.info(f"Rule already exists: {normalized_action} for {rule['source_ip']}")
             return True
 
-        iptables_success = self._execute_iptables_command(iptables_cmd)
+        iptables_success = self._ipset_restore([f"add {_TARGET_SET[target]} {rule['source_ip']}"])
         if not iptables_success:
             logger.error(f"Failed to apply rule to iptables: {rule}")
             return False
+        self._rules_cache.add((rule["source_ip"], target))
 
         rule["action"] = normalized_action
         data_success = self.data_manager.add_firewall_rule(rule)
@@ -122,30 +470,26 @@ class FirewallManager:
         return True
 
     def remove_rule(self, rule_id_or_ip: str) -> bool:
-        data = self.data_manager.load_data(update_stats=False)
-        rules = data.get("firewall_rules", [])
-        
-        rule_to_remove = next((r for r in rules if r.get("id") == rule_id_or_ip or r.get("source_ip") == rule_id_or_ip), None)
+        rule_to_remove = self.data_manager.get_firewall_rule(rule_id_or_ip)
         if not rule_to_remove:
             logger.warning(f"No rule found in data store for ID or IP: {rule_id_or_ip}")
             if self._rule_exists(rule_id_or_ip, "block"):
-                iptables_cmd = ["-D", "INPUT", "-s", rule_id_or_ip, "-j", "DROP"]
-                iptables_success = self._execute_iptables_command(iptables_cmd)
+                iptables_success = self._ipset_restore([f"del {_BLOCK_SET} {rule_id_or_ip}"])
                 if iptables_success:
+                    self._rules_cache.discard((rule_id_or_ip, "DROP"))
                     logger.info(f"Removed orphaned iptables rule for IP: {rule_id_or_ip}")
                     return True
             logger.info(f"No rule to remove for {rule_id_or_ip}, treating as success")
             return True
 
         source_ip = rule_to_remove["source_ip"]
-        action = rule_to_remove["action"].lower()
-        target = "DROP" if action in ("block", "drop") else "ACCEPT"
-        iptables_cmd = ["-D", "INPUT", "-s", source_ip, "-j", target]
+        target = _ACTION_TARGET.get(rule_to_remove["action"].lower(), "ACCEPT")
         
-        iptables_success = self._execute_iptables_command(iptables_cmd)
+        iptables_success = self._ipset_restore([f"del {_TARGET_SET[target]} {source_ip}"])
         if not iptables_success:
             logger.error(f"Failed to remove iptables rule for {source_ip}")
             return False
+        self._rules_cache.discard((source_ip, target))
 
         data_success = self.data_manager.remove_firewall_rule(source_ip)
         if not data_success:
@@ -155,18 +499,153 @@ class FirewallManager:
         logger.info(f"Successfully removed rule for: {source_ip}")
         return True
 
-    def apply_rules(self) -> bool:
-        self._execute_iptables_command(["-F", "INPUT"])
-        rules = self.get_rules()
+    def add_rules(self, rules: List[Dict[str, Any]]) -> bool:
+        """Add many rules with one ipset restore call and one data store commit."""
+        batch: Dict[str, Dict[str, Any]] = {}
         for rule in rules:
-            action = rule["action"].lower()
-            if action in ("block", "drop"):
-                iptables_cmd = ["-A", "INPUT", "-s", rule["source_ip"], "-j", "DROP"]
-            elif action in ("allow", "accept"):
-                iptables_cmd = ["-A", "INPUT", "-s", rule["source_ip"], "-j", "ACCEPT"]
+            if "source_ip" not in rule or "action" not in rule:
+                logger.error(f"Invalid firewall rule: missing required fields: {rule}")
+                continue
+            normalized_action = _NORMALIZED.get(rule["action"].lower())
+            if normalized_action is None:
+                logger.error(f"Unsupported action: {rule['action']}")
+                continue
+            try:
+                rule["source_ip"] = normalize_source_ip(rule["source_ip"])
+            except ValueError as e:
+                logger.error(f"Invalid firewall rule: {str(e)}")
+                continue
+            rule["action"] = normalized_action
+            batch[rule["source_ip"]] = rule
+
+        lines = []
+        conflicts = []
+        added = []
+        new_rules = []
+        for source_ip, rule in batch.items():
+            target = _ACTION_TARGET[rule["action"]]
+            conflicting_target = _ACTION_TARGET[_CONFLICT[rule["action"]]]
+            if (source_ip, conflicting_target) in self._rules_cache:
+                lines.append(f"del {_TARGET_SET[conflicting_target]} {source_ip}")
+                conflicts.append((source_ip, conflicting_target))
+            if (source_ip, target) in self._rules_cache:
+                continue
+            lines.append(f"add {_TARGET_SET[target]} {source_ip}")
+            added.append((source_ip, target))
+            new_rules.append(rule)
+
+        if not lines:
+            return True
+        if not self._ipset_restore(lines):
+            logger.error(f"Failed to apply {len(new_rules)} rules to iptables")
+            return False
+        self._rules_cache.difference_update(conflicts)
+        self._rules_cache.update(added)
+
+        if conflicts:
+            self.data_manager.remove_firewall_rules([source_ip for source_ip, _ in conflicts])
+        if new_rules and not self.data_manager.add_firewall_rules(new_rules):
+            logger.error(f"Failed to save {len(new_rules)} rules to data store")
+            return False
+
+        logger.info(f"Successfully added {len(new_rules)} rules")
+        return True
+
+    def remove_rules(self, rule_ids_or_ips: List[str]) -> bool:
+        """Remove many rules with one ipset restore call and one data store commit."""
+        lines = []
+        removed = []
+        known = []
+        for rule_id_or_ip in rule_ids_or_ips:
+            rule = self.data_manager.get_firewall_rule(rule_id_or_ip)
+            if rule is not None:
+                source_ip = rule["source_ip"]
+                target = _ACTION_TARGET.get(rule["action"].lower(), "ACCEPT")
+                known.append(source_ip)
             else:
+                source_ip, target = rule_id_or_ip, "DROP"
+            if (source_ip, target) in self._rules_cache and (source_ip, target) not in removed:
+                lines.append(f"del {_TARGET_SET[target]} {source_ip}")
+                removed.append((source_ip, target))
+
+        if lines:
+            if not self._ipset_restore(lines):
+                logger.error(f"Failed to remove {len(lines)} iptables rules")
+                return False
+            self._rules_cache.difference_update(removed)
+
+        if known and not self.data_manager.remove_firewall_rules(known):
+            logger.error(f"Failed to remove {len(known)} rules from data store")
+            return False
+
+        logger.info(f"Successfully removed {len(removed)} iptables rules")
+        return True
+
+    def _restore(self, lines: List[str]) -> bool:
+        """Commit iptables commands on the filter table in one iptables-restore transaction.
+
+        --noflush keeps the chain policies (emergency lockdown sets INPUT to
+        DROP) and any chain the commands do not touch.
+        """
+        if _has_line_break(lines):
+            logger.error(f"Refusing iptables-restore batch with a line break inside a command: {lines!r}")
+            return False
+        blob = "*filter\n" + "".join(f"{line}\n" for line in lines) + "COMMIT\n"
+        try:
+            self._sh_check(["iptables-restore", "--noflush"] + _LOCK_WAIT, input=blob, quiet=True)
+            logger.info(f"Committed {len(lines)} iptables commands via iptables-restore")
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.error(f"iptables-restore failed: {str(e)} - {e.stderr}")
+            return False
+
+    def _ipset_restore(self, lines: List[str]) -> bool:
+        """Run ipset commands in one ipset restore call; -exist makes adds, deletes and creates idempotent."""
+        if _has_line_break(lines):
+            logger.error(f"Refusing ipset restore batch with a line break inside a command: {lines!r}")
+            return False
+        blob = "".join(f"{line}\n" for line in lines)
+        try:
+            self._sh_check(["ipset", "-exist", "restore"], input=blob, quiet=True)
+            logger.info(f"Committed {len(lines)} ipset commands via ipset restore")
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.error(f"ipset restore failed: {str(e)} - {e.stderr}")
+            return False
+
+    def _apply_ruleset_atomic(self, rules: List[Dict[str, Any]]) -> bool:
+        ruleset = {}
+        for rule in rules:
+            target = _ACTION_TARGET.get(rule["action"].lower())
+            if target is None:
+                continue
+            # Stored rules may predate validation; only real addresses reach the batch
+            try:
+                source_ip = normalize_source_ip(rule["source_ip"])
+            except ValueError as e:
+                logger.error(f"Skipping stored rule with invalid source: {str(e)}")
                 continue
-            self._execute_iptables_command(iptables_cmd)
+            ruleset[(source_ip, target)] = None
+        desired = set(ruleset)
+        try:
+            current = self._read_members()
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to read existing rules: {str(e)}")
+            return False
+        # Only the delta is sent, and nothing is flushed, so there is never a
+        # moment where the installed lists are empty
+        lines = [f"del {_TARGET_SET[target]} {ip}" for ip, target in current - desired]
+        lines += [f"add {_TARGET_SET[target]} {ip}" for ip, target in ruleset if (ip, target) not in current]
+        if lines and not self._ipset_restore(lines):
+            return False
+        self._rules_cache = desired
+        return self._sync_chain()
+
+    def apply_rules(self) -> bool:
+        rules = self.get_rules()
+        if not self._apply_ruleset_atomic(rules):
+            logger.error("Failed to apply firewall rules to container")
+            return False
         logger.info(f"Applied {len(rules)} firewall rules to container")
         return True
 
@@ -187,17 +666,11 @@ class FirewallManager:
 
     def get_firewall_status(self) -> Dict[str, Any]:
         try:
-            result = subprocess.run(
-                ["docker", "exec", self.container_name, "iptables", "-L", "INPUT", "-n", "--line-numbers"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            rule_count = len([line for line in result.stdout.splitlines() if line.strip() and not line.startswith("Chain") and not line.startswith("num")])
+            rule_count = len(self._read_members())
             return {
                 "active": True,
                 "mode": "automatic",
-                "last_updated": datetime.now().isoformat(),
+                "last_updated": _now_iso(),
                 "rule_count": rule_count
             }
         except subprocess.CalledProcessError as e:
@@ -1,14 +1,16 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from typing import Dict, Any, Optional
 import asyncio
 import logging
+import orjson
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, field_validator
 from contextlib import asynccontextmanager
 
 from security_monitor import SecurityMonitor
-from firewall_manager import FirewallManager
+from firewall_manager import FirewallManager, normalize_source_ip
 from data_manager import DataManager
 
 logging.basicConfig(
@@ -23,14 +25,15 @@ async def lifespan(app: FastAPI):
     data_manager.reset_data()
     security_monitor.websocket_manager = websocket_manager
     logger.info("WebSocket manager linked to SecurityMonitor")
-    firewall_manager.apply_rules()
+    await asyncio.get_event_loop().run_in_executor(None, firewall_manager.apply_rules)
     asyncio.create_task(security_monitor.start_live_monitoring())
     asyncio.create_task(websocket_manager.heartbeat())
     yield
     websocket_manager.shutdown_event.set()
+    firewall_manager.close()
     logger.info("Application shutdown complete")
 
-app = FastAPI(title="Cybersecurity Dashboard Backend", lifespan=lifespan)
+app = FastAPI(title="Cybersecurity Dashboard Backend", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,11 +43,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-data_manager = DataManager("data/security_data.json")
+# Threats and rules are durable once their WAL group commit is synced (within
+# about 20 ms), so the full checkpoint (which rewrites the whole threat
+# history) only needs to run once a minute
+data_manager = DataManager("data/security_data.json.zst", checkpoint_interval=60.0)
 security_monitor = SecurityMonitor(data_manager)
 firewall_manager = FirewallManager(data_manager, container_name="demo_firewall")
 
 class FirewallRule(BaseModel):
+    # Unknown fields are rejected rather than collected, and strings are
+    # stripped in the core validator so the IP matches stored rules
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
     source_ip: str
     destination_ip: Optional[str] = None
     port: Optional[int] = None
@@ -52,6 +62,13 @@ class FirewallRule(BaseModel):
     action: str
     reason: Optional[str] = None
 
+    @field_validator("source_ip")
+    @classmethod
+    def _check_source_ip(cls, value: str) -> str:
+        # Ends up in ipset restore lines, so only an IPv4 address or CIDR
+        # block gets through, stored in the form ipset reports it
+        return normalize_source_ip(value)
+
 class WebSocketManager:
     def __init__(self):
         self.clients: Dict[str, WebSocket] = {}
@@ -77,41 +94,46 @@ class WebSocketManager:
             logger.info(f"Disconnected {client_id}. Remaining: {len(self.clients)}")
 
     async def broadcast(self, message: Dict[str, Any]):
-        disconnected = []
-        for client_id, ws in list(self.clients.items()):
-            try:
-                await ws.send_json(message)
-                logger.debug(f"Sent message to {client_id}: {message}")
-            except Exception as e:
-                logger.error(f"Failed to send to {client_id}: {str(e)}")
-                disconnected.append(client_id)
-        for client_id in disconnected:
-            await self.disconnect(client_id)
+        # Serialize once for all clients; sent as a text frame since the dashboard JSON.parses event.data
+        await self.broadcast_text(orjson.dumps(message).decode())
+
+    async def broadcast_text(self, message: str):
+        # Send to all clients concurrently so one slow socket doesn't hold up the rest
+        clients = list(self.clients.items())
+        results = await asyncio.gather(*(ws.send_text(message) for _, ws in clients), return_exceptions=True)
+        for (client_id, ws), result in zip(clients, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send to {client_id}: {str(result)}")
+                # The id may have reconnected with a new socket while we were sending
+                if self.clients.get(client_id) is ws:
+                    await self.disconnect(client_id)
+            else:
+                logger.debug("Sent message to %s: %s", client_id, message)
 
     async def heartbeat(self):
         while not self.shutdown_event.is_set():
             await asyncio.sleep(5)
             if self.clients:
-                await self.broadcast({"type": "heartbeat"})
+                await self.broadcast_text(_HEARTBEAT)
                 logger.debug("Heartbeat sent")
 
 websocket_manager = WebSocketManager()
+_HEARTBEAT = orjson.dumps({"type": "heartbeat"}).decode()
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     if not await websocket_manager.connect(websocket, client_id):
         return
     try:
-        threats = security_monitor.get_recent_threats()
         initial_data = {
             "type": "initial_data",
             "data": {
                 "stats": security_monitor.get_current_stats(),
-                "threats": threats,
-                "firewall_rules": firewall_manager.get_rules()
+                "threats": orjson.Fragment(data_manager.recent_threats_json(10)),
+                "firewall_rules": orjson.Fragment(data_manager.section_json("firewall_rules"))
             }
         }
-        await websocket.send_json(initial_data)
+        await websocket.send_text(orjson.dumps(initial_data).decode())
         logger.info(f"Initial data sent to {client_id}")
 
         while True:
@@ -121,14 +143,14 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     continue
                 elif data.get("type") == "emergency_lockdown":
                     if data["data"]["action"] == "block_all":
-                        firewall_manager.block_all_traffic()
+                        await asyncio.get_event_loop().run_in_executor(None, firewall_manager.block_all_traffic)
                         security_monitor.set_lockdown_state(True)  # Pause sniffing
                         await websocket_manager.broadcast({
                             "type": "emergency_lockdown",
                             "data": {"action": "block_all"}
                         })
                     elif data["data"]["action"] == "unblock_all":
-                        firewall_manager.unblock_all_traffic()
+                        await asyncio.get_event_loop().run_in_executor(None, firewall_manager.unblock_all_traffic)
                         security_monitor.set_lockdown_state(False)  # Resume sniffing
                         await websocket_manager.broadcast({
                             "type": "emergency_lockdown",
@@ -157,26 +179,27 @@ async def root():
 
 @app.get("/stats")
 async def get_stats():
-    return security_monitor.get_current_stats()
+    return ORJSONResponse(content=security_monitor.get_current_stats())
 
 @app.get("/firewall/rules")
 async def get_firewall_rules():
-    return firewall_manager.get_rules()
+    # Served from the data store's cached encoding; it is only rebuilt after a rule change
+    return Response(content=data_manager.section_json("firewall_rules"), media_type="application/json")
+
+def _update_threat_status(source_ip: str, status: str) -> Optional[Dict[str, Any]]:
+    # One WAL record for all of the source's threats, skipping those already
+    # in this status; a flooding source can have thousands, so run it in the executor
+    updated = data_manager.update_threats_by_source(source_ip, {"status": status})
+    threat = data_manager.get_threat(updated[0]) if updated else None
+    return dict(threat) if threat is not None else None
 
-@app.post("/firewall/rules")
+@app.post("/firewall/rules", response_class=ORJSONResponse)
 async def add_firewall_rule(rule: FirewallRule):
-    success = firewall_manager.add_rule(rule.model_dump())
+    success = await asyncio.get_event_loop().run_in_executor(None, firewall_manager.add_rule, rule.model_dump())
     if success:
-        data = data_manager.load_data()
-        threats = data.get("threats", [])
         stats = security_monitor.get_current_stats()
-        data_manager.update_stats(stats)
         if rule.action == "block":
-            threat_to_update = next((t for t in threats if t["source"] == rule.source_ip), None)
-            if threat_to_update:
-                threat_to_update["status"] = "blocked"
-                data["threats"] = threats
-                data_manager.save_data(data)
+            await asyncio.get_event_loop().run_in_executor(None, _update_threat_status, rule.source_ip, "blocked")
         await websocket_manager.broadcast({
             "type": "firewall_update",
             "data": {
@@ -187,28 +210,18 @@ async def add_firewall_rule(rule: FirewallRule):
                 "stats": stats
             }
         })
-        return {"success": True, "message": "Rule added successfully"}
+        return ORJSONResponse(content={"success": True, "message": "Rule added successfully"})
     raise HTTPException(status_code=400, detail="Failed to add firewall rule")
 
-@app.delete("/firewall/rules/{ip}")
+@app.delete("/firewall/rules/{ip}", response_class=ORJSONResponse)
 async def delete_firewall_rule(ip: str):
-    data = data_manager.load_data()
-    threats = data.get("threats", [])
-    firewall_rules = data.get("firewall_rules", [])
-    rule_to_remove = next((r for r in firewall_rules if r["source_ip"] == ip), None)
+    rule_to_remove = data_manager.get_firewall_rule(ip)
     
-    success = firewall_manager.remove_rule(ip)
+    success = await asyncio.get_event_loop().run_in_executor(None, firewall_manager.remove_rule, ip)
     if success:
-        data = data_manager.load_data()
-        threats = data.get("threats", [])
         stats = security_monitor.get_current_stats()
-        data_manager.update_stats(stats)
         
-        threat_to_update = next((t for t in threats if t["source"] == ip), None)
-        if threat_to_update:
-            threat_to_update["status"] = "detected"
-            data["threats"] = threats
-            data_manager.save_data(data)
+        threat_to_update = await asyncio.get_event_loop().run_in_executor(None, _update_threat_status, ip, "detected")
         
         await websocket_manager.broadcast({
             "type": "firewall_update",
@@ -220,15 +233,28 @@ async def delete_firewall_rule(ip: str):
                 "threat": threat_to_update if threat_to_update else None
             }
         })
-        return {"success": True, "message": f"Rule for IP {ip} deleted"}
+        return ORJSONResponse(content={"success": True, "message": f"Rule for IP {ip} deleted"})
     raise HTTPException(status_code=404, detail=f"Rule for IP {ip} not found")
 
 @app.get("/api/threats/recent")
 async def get_recent_threats():
-    threats = security_monitor.get_recent_threats(limit=10)
+    # The dashboard polls this; the encoding is reused until a threat changes
+    threats = data_manager.recent_threats_json(10)
     logger.info("Returning recent threats via API")
-    return threats
+    return Response(content=threats, media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    try:
+        import uvloop  # noqa: F401  (not available on Windows)
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    # One worker on purpose: the sniffer, the WAL-backed data store, the ipset
+    # state and the WebSocket clients it broadcasts to all live in this process.
+    # Blocking and CPU-heavy work is kept off the event loop with run_in_executor.
+    # Broadcasts are encoded once for every client, but permessage-deflate would
+    # still compress each frame once per connection; the dashboard is local,
+    # so the frames go out uncompressed.
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, loop=loop, ws="websockets", workers=1,
+                ws_per_message_deflate=False)
\ No newline at end of file
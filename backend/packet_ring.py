@@ -0,0 +1,124 @@
+"""Linux PACKET_MMAP (TPACKET_V3) receive ring.
+
+The kernel copies each accepted frame into a ring buffer shared with this
+process, so reading a packet is a memory access rather than a recv() call
+and a fresh bytes object per packet. TPACKET_V3 packs frames back to back
+into blocks and hands over a whole block at once, so small packets (a SYN
+flood's are ~60 bytes) don't each take a fixed-size slot, and the status
+handshake with the kernel happens once per block instead of per packet.
+"""
+import mmap
+import socket
+import struct
+from typing import Iterator, Optional, Tuple
+
+_SOL_PACKET = 263
+_PACKET_VERSION = 10
+_PACKET_RX_RING = 5
+_PACKET_STATISTICS = 6
+_TPACKET_V3 = 2
+_TP_STATUS_KERNEL = 0
+_TP_STATUS_USER = 1
+_ETH_P_IP = 0x0800
+
+# struct tpacket_req3: block size, block count, frame size, frame count,
+# block retire timeout (ms), private area size, feature flags
+_REQ3 = struct.Struct("IIIIIII")
+# struct tpacket_hdr_v1 at offset 8 of each block: block_status, num_pkts,
+# offset_to_first_pkt
+_BLOCK_STATUS_OFFSET = 8
+_BLOCK_HDR = struct.Struct("III")
+# Leading fields of struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec,
+# tp_snaplen, tp_len, tp_status, tp_mac, tp_net
+_FRAME_HDR = struct.Struct("IIIIIIHH")
+_STATUS = struct.Struct("I")
+_STATS = struct.Struct("III")  # struct tpacket_stats_v3: tp_packets, tp_drops, tp_freeze_q_cnt
+
+class RxRing:
+    """AF_PACKET socket bound to one interface for IPv4, read through an mmap'd ring.
+
+    A block is handed over once it fills or block_timeout (ms) after its
+    first packet, whichever comes first; packets keep their kernel arrival
+    time either way.
+
+    Raises OSError where the ring cannot be set up (no AF_PACKET, not root,
+    old kernel); callers are expected to fall back to a regular socket.
+    """
+
+    def __init__(self, iface: str, bpf_filter: Optional[str] = None, block_size: int = 1 << 20,
+                 block_count: int = 16, frame_size: int = 2048, block_timeout: int = 10):
+        if not hasattr(socket, "AF_PACKET"):
+            raise OSError("AF_PACKET sockets are not available on this platform")
+        self._block_size = block_size
+        self._block_count = block_count
+        self._next = 0  # Block the kernel fills next, in ring order
+
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(_ETH_P_IP))
+        try:
+            if bpf_filter:
+                # Imported here: scapy.arch.linux only loads on Linux
+                from scapy.arch.linux import attach_filter
+                attach_filter(sock, bpf_filter, iface)
+            sock.setsockopt(_SOL_PACKET, _PACKET_VERSION, _TPACKET_V3)
+            sock.setsockopt(_SOL_PACKET, _PACKET_RX_RING,
+                            _REQ3.pack(block_size, block_count, frame_size,
+                                       block_size // frame_size * block_count, block_timeout, 0, 0))
+            self._ring = mmap.mmap(sock.fileno(), block_size * block_count,
+                                   mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            sock.bind((iface, _ETH_P_IP))
+        except BaseException:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def _ready(self) -> bool:
+        return bool(_STATUS.unpack_from(self._ring, self._next * self._block_size + _BLOCK_STATUS_OFFSET)[0]
+                    & _TP_STATUS_USER)
+
+    def wait(self, timeout: float) -> bool:
+        """Block until a block of frames is waiting or timeout (seconds) passes."""
+        if self._ready():
+            return True
+        import select  # poll() is POSIX-only, like the ring itself
+        poller = select.poll()
+        poller.register(self._sock, select.POLLIN | select.POLLERR)
+        poller.poll(timeout * 1000)
+        return self._ready()
+
+    def frames(self) -> Iterator[Tuple[mmap.mmap, int, int, float]]:
+        """Yield (ring, start, end, arrival time) for each waiting IP packet, oldest first.
+
+        The arrival time is the kernel's receive timestamp (time.time() clock),
+        so it stays accurate however long the consumer takes per packet.
+
+        A block goes back to the kernel once its last frame has been yielded
+        or iteration stops, so the bytes are only valid until then.
+        """
+        ring = self._ring
+        while True:
+            base = self._next * self._block_size
+            status, num_pkts, offset = _BLOCK_HDR.unpack_from(ring, base + _BLOCK_STATUS_OFFSET)
+            if not status & _TP_STATUS_USER:
+                return
+            try:
+                offset += base
+                for _ in range(num_pkts):
+                    next_offset, sec, nsec, snaplen, _, _, mac, net = _FRAME_HDR.unpack_from(ring, offset)
+                    yield ring, offset + net, offset + mac + snaplen, sec + nsec * 1e-9
+                    offset += next_offset
+            finally:
+                _STATUS.pack_into(ring, base + _BLOCK_STATUS_OFFSET, _TP_STATUS_KERNEL)
+                self._next = (self._next + 1) % self._block_count
+
+    def stats(self) -> Tuple[int, int]:
+        """(packets, drops) counted by the kernel since the previous call.
+
+        Drops are frames the filter accepted that found no room in the ring,
+        i.e. packets lost because the consumer fell behind.
+        """
+        packets, drops, _ = _STATS.unpack(self._sock.getsockopt(_SOL_PACKET, _PACKET_STATISTICS, _STATS.size))
+        return packets, drops
+
+    def close(self):
+        self._ring.close()
+        self._sock.close()
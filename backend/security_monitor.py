@@ -1,29 +1,296 @@
 import logging
 import asyncio
-import uuid
+import functools
+import os
+import threading
 import time
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Set, Tuple
+from datetime import datetime
 import psutil
 import socket
-from scapy.all import sniff, IP, TCP, UDP, ICMP
+import struct
+from scapy.all import conf, raw, Ether, IP
 from collections import deque, defaultdict
+from packet_ring import RxRing
 import aiohttp
+import orjson
 
 logger = logging.getLogger("security-monitor")
 
+_PROTO_ICMP = 1
+_PROTO_TCP = 6
+_PROTO_UDP = 17
+_TCP_SYN = 0x02
+# FIN|SYN|RST|ACK: a connection-opening SYN has only SYN set among these;
+# PSH/URG and the ECN bits (ECE/CWR, set on ECN-capable SYNs) are ignored
+_TCP_SYN_MASK = 0x17
+
+# Packet classes, decided once when the headers are decoded; the rules and
+# ML features dispatch on this one int instead of re-testing proto/flags/type
+_PKT_OTHER, _PKT_TCP, _PKT_TCP_SYN, _PKT_UDP, _PKT_ICMP, _PKT_ICMP_ECHO = range(6)
+# Class -> (is_tcp, is_udp, is_icmp, is_syn) model features
+_CLASS_FEATURES = (
+    (0, 0, 0, 0),
+    (1, 0, 0, 0),
+    (1, 0, 0, 1),
+    (0, 1, 0, 0),
+    (0, 0, 1, 0),
+    (0, 0, 1, 0),
+)
+_ETH_P_IP = 0x0800
+_ETH_P_8021Q = 0x8100
+# Kernel-side filter: only packets addressed to this host reach userspace.
+# Not narrowed by protocol: the DDoS rule counts every IP packet, so a flood
+# of e.g. GRE or ESP must still arrive (classed _PKT_OTHER)
+_CAPTURE_FILTER = "dst host {}"
+# Kernel-side capture buffer, sized to absorb a flood while the analyzer
+# catches up: the mmap ring's size, or SO_RCVBUF(FORCE) on the fallback socket
+_CAPTURE_BUFFER = 16 * 1024 * 1024
+_RING_BLOCK_SIZE = 1 << 20
+_DROP_REPORT_INTERVAL = 10.0  # Seconds between checks of the ring's kernel drop counter
+_CLEANUP_INTERVAL = 30.0  # Seconds between sweeps of the per-source tracking dicts
+_TRACKING_TTL = 300.0  # Seconds a source's counters and dedup entries are kept
+_HOST_STATS_TTL = 1.0  # Seconds a psutil traffic/users reading is reused
+_ML_CACHE_SIZE = 4096  # Predictions kept per quantized feature vector
+_ML_BATCH_SIZE = 64  # Most feature vectors sent in one ML request
+_ML_BATCH_DELAY = 0.01  # Seconds the flusher waits for more vectors after the first
+_ML_CONNECTIONS = 4
+# ML bodies are encoded/decoded with orjson rather than aiohttp's stdlib json
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# ML feature vectors are plain tuples in this order until they are sent
+_FEATURE_NAMES = ("packet_rate", "unique_ports", "syn_count", "icmp_count", "is_tcp", "is_udp", "is_icmp", "is_syn")
+_DEDUP_GENERATION_SIZE = 65536  # Reported-threat keys per generation before an early rotation
+_STATS_POOL_SIZE = 4096  # Evicted per-source records kept for reuse by new sources
+_BROADCAST_BACKLOG = 1024  # Threats held for broadcast before new ones are dropped
+_BROADCAST_BATCH = 256  # Most threats sent in one threats_update message
+_BROADCAST_DELAY = 0.05  # Seconds a wakeup waits so a burst goes out as one message
+_SNIFFER_NICE = -5  # Raised scheduling priority for the capture thread, where permitted
+_IPV4_PAIR = struct.Struct("!II")
+
+# Threat kinds; dedup keys are (source as uint32, kind, port) tuples, which
+# hash far cheaper than "1.2.3.4:BruteForce:22" strings
+_KIND_DDOS, _KIND_PORT_SCAN, _KIND_BRUTE_FORCE, _KIND_ICMP_FLOOD = range(4)
+
+def _ip_str(ip: int) -> str:
+    """Dotted-quad text for an address kept as a host-order uint32."""
+    return socket.inet_ntoa(ip.to_bytes(4, "big"))
+
+class _SourceStats:
+    """Per-source counters behind the detection rules and ML features."""
+    __slots__ = ("times", "ports", "syn_counts", "syn_total", "icmp_times", "packet_count", "last_reset")
+
+    def __init__(self, now: float):
+        # Packet arrival times. A bounded deque gives O(1) append, len and
+        # first/last reads; a hand-indexed array ring measured slower in CPython
+        self.times = deque(maxlen=500)  # Increased to handle larger attacks
+        self.ports = set()  # Distinct destination ports; only their number is used
+        # Created on the first SYN / echo request: most sources never send
+        # one, and these two are about half the record's memory
+        self.syn_counts: Optional[defaultdict] = None
+        self.syn_total = 0  # Running sum of syn_counts
+        self.icmp_times: Optional[deque] = None
+        self.packet_count = 0
+        self.last_reset = now
+
+    def reset(self, now: float):
+        """Start a new detection window; packet_count is cumulative and kept."""
+        self.times.clear()
+        self.ports.clear()
+        if self.syn_counts is not None:
+            self.syn_counts.clear()
+        self.syn_total = 0
+        if self.icmp_times is not None:
+            self.icmp_times.clear()
+        self.last_reset = now
+
+    def last_seen(self) -> float:
+        """Arrival time of the newest packet in the window, else the window start."""
+        try:
+            return self.times[-1]
+        except IndexError:  # Empty, possibly emptied by reset() on another thread
+            return self.last_reset
+
+# Detection rules, one function per packet class holding only the rules that
+# can fire for it; _RULES dispatches on the class from the header decoder.
+# Each returns (threat kind, type, severity, details) on a hit, else None.
+# The kind is that of the last rule the class runs, so a source keeps one
+# dedup key per class whichever rule fired. DDoS needs a window over 5s while
+# port scans and brute force need one under 5s, so for TCP/UDP at most one
+# of them fires; ICMP floods use their own ping window and can coincide.
+
+def _ddos(window: int, time_span: float) -> Optional[str]:
+    """Details for a sustained-rate hit on the packet window, else None."""
+    if window > 5 and time_span > 5:
+        packet_rate = window / time_span
+        if packet_rate > 10:
+            return f"Sustained rate: {packet_rate:.2f} pps over {time_span:.1f}s"
+    return None
+
+def _rules_ip(stats: _SourceStats, dport: Optional[int]) -> Optional[Tuple[int, str, str, str]]:
+    # Other protocols, non-echo ICMP, and TCP/UDP without a transport header
+    times = stats.times
+    window = len(times)
+    if window > 5:
+        details = _ddos(window, times[-1] - times[0])
+        if details is not None:
+            return _KIND_DDOS, "DDoS", "high", details
+    return None
+
+def _rules_ported(stats: _SourceStats, dport: Optional[int]) -> Optional[Tuple[int, str, str, str]]:
+    if dport is None:
+        return _rules_ip(stats, dport)
+    times = stats.times
+    window = len(times)
+    if window < 2:
+        return None
+    time_span = times[-1] - times[0]
+    if time_span > 5:
+        details = _ddos(window, time_span)
+        if details is not None:
+            return _KIND_PORT_SCAN, "DDoS", "high", details
+    elif time_span < 3 and len(stats.ports) > 3:
+        return _KIND_PORT_SCAN, "Port Scan", "medium", f"Hit {len(stats.ports)} ports in {time_span:.1f}s"
+    return None
+
+def _rules_tcp_syn(stats: _SourceStats, dport: Optional[int]) -> Optional[Tuple[int, str, str, str]]:
+    times = stats.times
+    window = len(times)
+    if window < 2:
+        return None
+    time_span = times[-1] - times[0]
+    if time_span > 5:
+        details = _ddos(window, time_span)
+        if details is not None:
+            return _KIND_BRUTE_FORCE, "DDoS", "high", details
+        return None
+    syn_count = stats.syn_counts[dport]
+    if time_span < 5 and syn_count > 5:
+        return _KIND_BRUTE_FORCE, "Brute Force", "medium", f"{syn_count} SYNs to port {dport} in {time_span:.1f}s"
+    if time_span < 3 and len(stats.ports) > 3:
+        return _KIND_BRUTE_FORCE, "Port Scan", "medium", f"Hit {len(stats.ports)} ports in {time_span:.1f}s"
+    return None
+
+def _rules_icmp_echo(stats: _SourceStats, dport: Optional[int]) -> Optional[Tuple[int, str, str, str]]:
+    times = stats.times
+    window = len(times)
+    ddos = _ddos(window, times[-1] - times[0]) if window > 5 else None
+    icmp_times = stats.icmp_times
+    icmp_len = len(icmp_times)
+    if icmp_len > 10:
+        icmp_span = icmp_times[-1] - icmp_times[0]
+        if icmp_span < 3:
+            return (_KIND_ICMP_FLOOD, "ICMP Flood", "high" if ddos is not None else "medium",
+                    f"{icmp_len} pings in {icmp_span:.1f}s")
+    if ddos is not None:
+        return _KIND_ICMP_FLOOD, "DDoS", "high", ddos
+    return None
+
+# Indexed by packet class (_PKT_OTHER .. _PKT_ICMP_ECHO)
+_RULES = (_rules_ip, _rules_ported, _rules_tcp_syn, _rules_ported, _rules_ip, _rules_icmp_echo)
+
+def _feature_key(features: tuple) -> tuple:
+    """Cache key for an ML feature vector; packet_rate is bucketed to whole pps."""
+    return (int(features[0]),) + features[1:]
+
+def _feature_dict(features: tuple) -> Dict[str, float]:
+    """The named form the ML API takes; only built for vectors actually sent."""
+    return dict(zip(_FEATURE_NAMES, features))
+
+def _parse_frame(cls, data: bytes) -> Optional[tuple]:
+    """Pull (src, dst, packet class, dport) out of a captured frame; addresses are uint32.
+
+    Ethernet/IPv4 frames are decoded straight from header offsets; anything
+    else goes through scapy once to find the IP header.
+    """
+    if cls is Ether:
+        if len(data) < 34:
+            return None
+        offset = 14
+        ethertype = struct.unpack_from("!H", data, 12)[0]
+        if ethertype == _ETH_P_8021Q:
+            ethertype = struct.unpack_from("!H", data, 16)[0]
+            offset = 18
+        if ethertype != _ETH_P_IP:
+            return None
+    else:
+        pkt = cls(data)
+        if IP not in pkt:
+            return None
+        data = raw(pkt[IP])
+        offset = 0
+    return _parse_ip(data, offset, len(data))
+
+def _parse_ip(data, offset: int, end: int) -> Optional[tuple]:
+    """Decode an IPv4 packet held in data[offset:end] (bytes or the capture ring)."""
+    if end < offset + 20 or data[offset] >> 4 != 4:
+        return None
+    ihl = (data[offset] & 0x0F) * 4
+    proto = data[offset + 9]
+    src_ip, dst_ip = _IPV4_PAIR.unpack_from(data, offset + 12)
+    dport = None
+    l4 = offset + ihl
+    # Non-first fragments carry no transport header
+    first = struct.unpack_from("!H", data, offset + 6)[0] & 0x1FFF == 0
+    if proto == _PROTO_TCP:
+        pkt_class = _PKT_TCP
+        if first and end >= l4 + 14:
+            dport = struct.unpack_from("!H", data, l4 + 2)[0]
+            if data[l4 + 13] & _TCP_SYN_MASK == _TCP_SYN:
+                pkt_class = _PKT_TCP_SYN
+    elif proto == _PROTO_UDP:
+        pkt_class = _PKT_UDP
+        if first and end >= l4 + 4:
+            dport = struct.unpack_from("!H", data, l4 + 2)[0]
+    elif proto == _PROTO_ICMP:
+        pkt_class = _PKT_ICMP_ECHO if first and end >= l4 + 1 and data[l4] == 8 else _PKT_ICMP
+    else:
+        pkt_class = _PKT_OTHER
+    return src_ip, dst_ip, pkt_class, dport
+
 class SecurityMonitor:
-    def __init__(self, data_manager):
+    def __init__(self, data_manager, sniffer_cpu: Optional[int] = None, sniffer_rt_priority: int = 0):
+        """sniffer_cpu: CPU to pin the capture thread to, e.g. a core isolated
+        with isolcpus (default: the last CPU the process may use).
+        sniffer_rt_priority: SCHED_FIFO priority (1-99) for the capture thread;
+        0 keeps normal scheduling with a raised nice value."""
         self.data_manager = data_manager
+        self.sniffer_cpu = sniffer_cpu
+        self.sniffer_rt_priority = sniffer_rt_priority
         self.network_interface = self._get_default_interface()
         self.local_ip = self._get_local_ip()
+        self._local_ip_n = int.from_bytes(socket.inet_aton(self.local_ip), "big")
         self.packet_counts = {}
-        self.reported_threats = {}  # Tracks reported threats
+        # Records evicted by cleanup, recycled for new sources so a flood of
+        # spoofed addresses doesn't allocate fresh deques/sets per packet
+        self._stats_pool: List[_SourceStats] = []
+        # Reported threat keys, in two generations: new keys go into the
+        # current set and lookups check both. Rotating drops the older set
+        # whole, so expiry needs no sweep, and capping each generation keeps
+        # memory bounded however many sources an attack spreads across.
+        self.reported_threats: Set[tuple] = set()
+        self._reported_prev: Set[tuple] = set()
+        self._reported_rotated = time.time()
         self.detection_attempts = {}  # Tracks detection attempts for re-evaluation
+        self._ml_pending: Set[tuple] = set()  # Threat keys with an ML request in flight
+        self._ml_cache: Dict[tuple, Dict[str, float]] = {}  # Quantized features -> prediction, oldest first
         self.websocket_manager = None
-        self.loop = asyncio.get_event_loop()
+        self.loop = None  # Bound to the server's running loop in start_live_monitoring
+        # Threats waiting to be broadcast. Producers append from any thread
+        # (deque.append is atomic) and only wake the loop when no wakeup is
+        # already outstanding, so a burst costs one call_soon_threadsafe.
+        self._pending_threats: deque = deque()
+        self._threats_ready: Optional[asyncio.Event] = None
+        self._wakeup_pending = False
+        self._broadcast_task = None
+        self._cleanup_task = None
+        self._ml_task = None
         self.is_locked_down = False
+        self._iso_cache = (-1, "")  # (epoch ms, isoformat) of the last threat stamp
+        self._host_stats = (0.0, None)  # (monotonic time, (network_traffic, active_users))
         self.ml_api_url = "https://6433-34-16-197-255.ngrok-free.app/predict"  # Latest ngrok URL
+        self.ml_batch_url = self.ml_api_url + "_batch"
+        self._ml_batch_supported = True  # Cleared once the API answers 404/405 for the batch URL
+        self._ml_queue: Optional[asyncio.Queue] = None  # (features, future) pairs awaiting _ml_flusher
         self.session = None
         logger.info(f"All network interfaces: {psutil.net_if_addrs()}")
         logger.info(f"Initialized with interface: {self.network_interface}, local IP: {self.local_ip}, ML API: {self.ml_api_url}")
@@ -31,8 +298,13 @@ class SecurityMonitor:
     def _get_default_interface(self) -> str:
         try:
             net_io = psutil.net_io_counters(pernic=True)
+            addrs = psutil.net_if_addrs()
             for iface, stats in net_io.items():
-                if "Loopback" not in iface and stats.bytes_sent + stats.bytes_recv > 0:
+                # Loopback is named "Loopback ..." on Windows but "lo" on Linux,
+                # so it is also recognised by its 127.x address
+                loopback = "Loopback" in iface or any(
+                    a.family == socket.AF_INET and a.address.startswith("127.") for a in addrs.get(iface, ()))
+                if not loopback and stats.bytes_sent + stats.bytes_recv > 0:
                     logger.info(f"Selected active interface: {iface} (sent: {stats.bytes_sent}, recv: {stats.bytes_recv})")
                     return iface
             logger.warning("No active interfaces found, defaulting to 'Ethernet'")
@@ -42,85 +314,247 @@ class SecurityMonitor:
             return "Ethernet"
 
     def _get_local_ip(self) -> str:
+        # Read the selected interface's own IPv4 address; the routing probe
+        # (a UDP "connect" towards 8.8.8.8) is only a fallback for when the
+        # interface is unknown to psutil or has no IPv4 address
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            logger.info(f"Detected local IP: {local_ip}")
+            addrs = psutil.net_if_addrs().get(self.network_interface, ())
+            local_ip = next((a.address for a in addrs if a.family == socket.AF_INET), None)
+            if local_ip is not None:
+                logger.info(f"Detected local IP: {local_ip} (from {self.network_interface})")
+                return local_ip
+            logger.warning(f"No IPv4 address on {self.network_interface}, asking the routing table")
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(("8.8.8.8", 80))
+                local_ip = s.getsockname()[0]
+            logger.info(f"Detected local IP: {local_ip} (from the default route)")
             return local_ip
         except Exception as e:
-            logger.error(f"Failed to get local IP: {str(e)}")
+            # The capture filter is built from this address, so loopback means
+            # no external traffic is seen at all; make that loud
+            logger.error(f"Failed to get local IP: {str(e)}. Monitoring 127.0.0.1 only; external traffic will not be analyzed")
             return "127.0.0.1"
 
     async def start_live_monitoring(self):
         logger.info(f"Starting live monitoring on {self.network_interface} for {self.local_ip}")
-        async with aiohttp.ClientSession() as session:
+        self.loop = asyncio.get_running_loop()
+        self._threats_ready = asyncio.Event()
+        self._broadcast_task = asyncio.create_task(self._broadcast_worker())
+        self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+        self._ml_queue = asyncio.Queue()
+        # A few kept-alive connections so batches reuse a warm TLS session
+        connector = aiohttp.TCPConnector(limit=_ML_CONNECTIONS, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector) as session:
             self.session = session
+            self._ml_task = asyncio.create_task(self._ml_flusher())
+            # The sniffer never returns, so it gets its own thread rather than
+            # holding a slot in the default executor used by the API routes
+            stopped = self.loop.create_future()
             try:
-                await asyncio.get_event_loop().run_in_executor(None, self._sniff_packets_continuously)
+                threading.Thread(target=self._run_sniffer, args=(stopped,), name="packet-sniffer", daemon=True).start()
+                await stopped
             except Exception as e:
                 logger.error(f"Error starting live monitoring: {str(e)}")
 
+    def _run_sniffer(self, stopped: asyncio.Future):
+        try:
+            self._tune_sniffer_thread()
+            self._sniff_packets_continuously()
+        except BaseException as e:
+            self.loop.call_soon_threadsafe(stopped.set_exception, e)
+        else:
+            self.loop.call_soon_threadsafe(stopped.set_result, None)
+
+    def _tune_sniffer_thread(self):
+        # Linux applies these settings to the calling thread only. By default
+        # the sniffer takes the last allowed CPU, leaving the first ones to
+        # the event loop and the default executor; staying on one CPU keeps
+        # the per-source tables warm in its cache.
+        if hasattr(os, "sched_setaffinity"):
+            try:
+                cpu = self.sniffer_cpu
+                if cpu is None:
+                    cpus = sorted(os.sched_getaffinity(0))
+                    cpu = cpus[-1] if len(cpus) > 1 else None
+                if cpu is not None:
+                    os.sched_setaffinity(0, {cpu})
+                    logger.info(f"Packet sniffer pinned to CPU {cpu}")
+            except OSError as e:
+                logger.info(f"Packet sniffer not pinned: {str(e)}")
+        # SCHED_FIFO lets the sniffer preempt normal threads as soon as the
+        # ring has frames; it blocks in poll() otherwise, and the kernel's RT
+        # throttling still reserves a share of the CPU for other work
+        if self.sniffer_rt_priority > 0 and hasattr(os, "sched_setscheduler"):
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.sniffer_rt_priority))
+                logger.info(f"Packet sniffer running SCHED_FIFO at priority {self.sniffer_rt_priority}")
+                return
+            except OSError as e:
+                logger.info(f"Packet sniffer cannot use SCHED_FIFO: {str(e)}")
+        if hasattr(os, "setpriority"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), _SNIFFER_NICE)
+            except OSError as e:
+                logger.info(f"Packet sniffer keeps default priority: {str(e)}")
+
     def _sniff_packets_continuously(self):
+        capture_filter = _CAPTURE_FILTER.format(self.local_ip)
         while True:
             if self.is_locked_down:
                 logger.info("System in lockdown, pausing packet sniffing")
                 time.sleep(5)
                 continue
             try:
-                logger.info(f"Starting packet sniffing on {self.network_interface} with filter 'dst host {self.local_ip}'")
-                sniff(
-                    iface=self.network_interface,
-                    prn=self._analyze_packet,
-                    filter=f"dst host {self.local_ip}",
-                    store=0,
-                    timeout=300
-                )
-                logger.info("Sniffing stopped, restarting after timeout or interruption")
+                logger.info(f"Starting packet sniffing on {self.network_interface} with filter '{capture_filter}'")
+                # The BPF program is compiled and attached when the socket is
+                # opened, so the socket is kept until sniffing pauses
+                sock, capture = self._open_capture(capture_filter)
+                try:
+                    capture(sock)
+                finally:
+                    sock.close()
+                logger.info("Sniffing stopped for lockdown")
             except Exception as e:
                 logger.error(f"Error sniffing packets on {self.network_interface}: {str(e)}. Retrying in 5 seconds...")
                 time.sleep(5)
 
-    def _extract_features(self, pkt, stats: Dict[str, Any]) -> Dict[str, float]:
+    def _open_capture(self, capture_filter: str):
+        # Prefer the zero-copy PACKET_MMAP ring (Linux, root); scapy's listen
+        # socket covers everything else, e.g. Npcap on Windows
+        try:
+            ring = RxRing(self.network_interface, capture_filter, block_size=_RING_BLOCK_SIZE,
+                          block_count=_CAPTURE_BUFFER // _RING_BLOCK_SIZE)
+            return ring, self._capture_ring
+        except (OSError, ImportError) as e:
+            logger.info(f"Packet ring unavailable ({str(e)}), capturing through scapy")
+        sock = conf.L2listen(iface=self.network_interface, filter=capture_filter)
+        # scapy leaves its Linux packet socket at conf.bufsize (64 KiB), which
+        # overflows within milliseconds of a flood. FORCE bypasses rmem_max
+        # but needs CAP_NET_ADMIN; plain SO_RCVBUF is capped at rmem_max.
+        ins = getattr(sock, "ins", None)
+        if isinstance(ins, socket.socket):
+            for option in (getattr(socket, "SO_RCVBUFFORCE", None), socket.SO_RCVBUF):
+                if option is None:
+                    continue
+                try:
+                    ins.setsockopt(socket.SOL_SOCKET, option, _CAPTURE_BUFFER)
+                    break
+                except OSError:
+                    continue
+        return sock, self._capture
+
+    def _capture_ring(self, ring: RxRing):
+        # Each wakeup drains every frame the kernel has queued; packets are
+        # stamped with their kernel arrival time rather than a clock read here
+        # The kernel's drop counter is the measure of whether per-packet
+        # analysis in Python keeps up with the link, so it is logged
+        analyze = self._analyze_packet
+        next_report = time.monotonic() + _DROP_REPORT_INTERVAL
+        while not self.is_locked_down:
+            if time.monotonic() >= next_report:
+                next_report += _DROP_REPORT_INTERVAL
+                packets, drops = ring.stats()
+                if drops:
+                    logger.warning("Capture ring dropped %d of %d packets in the last %.0fs",
+                                   drops, packets, _DROP_REPORT_INTERVAL)
+            if not ring.wait(1.0):
+                continue
+            for data, start, end, arrived in ring.frames():
+                fields = _parse_ip(data, start, end)
+                if fields is not None:
+                    analyze(*fields, arrived)
+                if self.is_locked_down:
+                    break
+
+    def _capture(self, sock):
+        # Frames are read raw and parsed from their header offsets, so scapy
+        # never dissects the common Ethernet/IPv4 packet into layer objects.
+        while not self.is_locked_down:
+            if not sock.select([sock], 1.0):
+                continue
+            cls, data, _ = sock.recv_raw()
+            if data is None:
+                continue
+            fields = _parse_frame(cls, data)
+            if fields is not None:
+                self._analyze_packet(*fields)
+
+    def _extract_features(self, pkt_class: int, stats: _SourceStats, current_time: float) -> tuple:
         """Extract features matching the Colab model with capped values."""
         try:
-            current_time = time.time()
-            time_span = current_time - stats["last_reset"] if stats["times"] else 0.001
-            packet_rate = min(len(stats["times"]) / time_span, 1000)
-            unique_ports = min(len(stats["ports"]), 100)
-            syn_count = min(sum(stats["syn_counts"].values()), 100)
-            icmp_count = min(len(stats["icmp_times"]), 100)
-
-            is_tcp = 1 if TCP in pkt else 0
-            is_udp = 1 if UDP in pkt else 0
-            is_icmp = 1 if pkt.haslayer(ICMP) else 0
-            is_syn = 1 if TCP in pkt and pkt[TCP].flags == "S" else 0
-
-            features = {
-                "packet_rate": packet_rate,
-                "unique_ports": unique_ports,
-                "syn_count": syn_count,
-                "icmp_count": icmp_count,
-                "is_tcp": is_tcp,
-                "is_udp": is_udp,
-                "is_icmp": is_icmp,
-                "is_syn": is_syn
-            }
-            logger.debug(f"Extracted features: {features}")
-            return features
+            # Measured to the packet's own arrival time, the clock the window
+            # was stamped with; it can equal last_reset right after a reset
+            time_span = max(current_time - stats.last_reset, 0.001) if stats.times else 0.001
+            packet_rate = min(len(stats.times) / time_span, 1000)
+            unique_ports = min(len(stats.ports), 100)
+            syn_count = min(stats.syn_total, 100)
+            icmp_count = min(len(stats.icmp_times), 100) if stats.icmp_times is not None else 0
+
+            return (packet_rate, unique_ports, syn_count, icmp_count) + _CLASS_FEATURES[pkt_class]
         except Exception as e:
             logger.error(f"Error extracting features: {str(e)}")
-            return {key: 0 for key in ["packet_rate", "unique_ports", "syn_count", "icmp_count", "is_tcp", "is_udp", "is_icmp", "is_syn"]}
+            return (0,) * len(_FEATURE_NAMES)
+
+    async def _predict_with_ml(self, features: tuple) -> Optional[Dict[str, float]]:
+        # Queued for _ml_flusher, which sends whatever has accumulated as one request
+        future = self.loop.create_future()
+        await self._ml_queue.put((features, future))
+        return await future
 
-    async def _predict_with_ml(self, features: Dict[str, float]) -> Optional[Dict[str, float]]:
+    async def _ml_flusher(self):
+        while True:
+            batch = [await self._ml_queue.get()]
+            deadline = self.loop.time() + _ML_BATCH_DELAY
+            while len(batch) < _ML_BATCH_SIZE:
+                remain = deadline - self.loop.time()
+                if remain <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._ml_queue.get(), remain))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await self._predict_batch([features for features, _ in batch])
+            except Exception as e:
+                logger.error(f"Error calling ML API: {str(e)}")
+                results = [None] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _predict_batch(self, batch: List[tuple]) -> List[Optional[Dict[str, float]]]:
+        """POST {"batch": [...]} to <ml_api_url>_batch, expecting {"predictions": [...]} in order.
+
+        Falls back to one /predict call per entry for a single entry or when
+        the API has no batch endpoint.
+        """
+        if len(batch) > 1 and self._ml_batch_supported:
+            logger.info("Sending batch of %d to ML API: %s", len(batch), self.ml_batch_url)
+            async with self.session.post(self.ml_batch_url, data=orjson.dumps({"batch": [_feature_dict(f) for f in batch]}),
+                                         headers=_JSON_HEADERS) as response:
+                if response.status == 200:
+                    predictions = orjson.loads(await response.read())["predictions"]
+                    if len(predictions) == len(batch):
+                        return [{"prediction": p["prediction"], "probability": p["probability"]} for p in predictions]
+                    logger.error(f"ML API returned {len(predictions)} predictions for a batch of {len(batch)}")
+                    return [None] * len(batch)
+                if response.status not in (404, 405):
+                    logger.error(f"ML API returned status {response.status}: {await response.text()}")
+                    return [None] * len(batch)
+            logger.info("ML API has no batch endpoint, sending predictions one at a time")
+            self._ml_batch_supported = False
+        return await asyncio.gather(*(self._predict_one(features) for features in batch))
+
+    async def _predict_one(self, features: tuple) -> Optional[Dict[str, float]]:
+        features = _feature_dict(features)
         try:
-            logger.info(f"Sending request to ML API: {self.ml_api_url} with features: {features}")
-            async with self.session.post(self.ml_api_url, json=features) as response:
-                logger.info(f"ML API response status: {response.status}")
+            logger.info("Sending request to ML API: %s with features: %s", self.ml_api_url, features)
+            async with self.session.post(self.ml_api_url, data=orjson.dumps(features),
+                                         headers=_JSON_HEADERS) as response:
+                logger.info("ML API response status: %s", response.status)
                 if response.status == 200:
-                    result = await response.json()
-                    logger.info(f"ML API response: {result}")
+                    result = orjson.loads(await response.read())
+                    logger.info("ML API response: %s", result)
                     return {"prediction": result["prediction"], "probability": result["probability"]}
                 else:
                     logger.error(f"ML API returned status {response.status}: {await response.text()}")
@@ -129,207 +563,242 @@ class SecurityMonitor:
             logger.error(f"Error calling ML API: {str(e)}")
             return None
 
-    def _analyze_packet(self, pkt):
+    def _analyze_packet(self, src_ip: int, dst_ip: int, pkt_class: int, dport: Optional[int],
+                        current_time: Optional[float] = None):
+        # Addresses stay uint32 here; they only become text when a threat is built
         if self.is_locked_down:
             logger.debug("Ignoring packet: system is in lockdown")
             return
         try:
-            if IP not in pkt:
-                logger.debug("No IP layer in packet")
+            if dst_ip != self._local_ip_n:
+                logger.debug("Packet ignored: dst %08x != %s", dst_ip, self.local_ip)
                 return
 
-            src_ip = pkt[IP].src
-            dst_ip = pkt[IP].dst
-            logger.debug(f"Packet from {src_ip} to {dst_ip}")
-
-            if dst_ip != self.local_ip:
-                logger.debug(f"Packet ignored: dst {dst_ip} != {self.local_ip}")
-                return
+            if current_time is None:
+                current_time = time.time()
 
-            current_time = time.time()
-
-            if src_ip not in self.packet_counts:
-                self.packet_counts[src_ip] = {
-                    "times": deque(maxlen=500),  # Increased to handle larger attacks
-                    "ports": defaultdict(int),
-                    "syn_counts": defaultdict(int),
-                    "icmp_times": deque(maxlen=500),
-                    "packet_count": 0,
-                    "last_reset": current_time
-                }
-
-            stats = self.packet_counts[src_ip]
-            stats["times"].append(current_time)
-            stats["packet_count"] += 1
-            if TCP in pkt or UDP in pkt:
-                stats["ports"][pkt[TCP].dport if TCP in pkt else pkt[UDP].dport] += 1
-            if TCP in pkt and pkt[TCP].flags == "S":
-                stats["syn_counts"][pkt[TCP].dport] += 1
-            if pkt.haslayer(ICMP) and pkt[ICMP].type == 8:
-                stats["icmp_times"].append(current_time)
-
-            if current_time - stats["last_reset"] > 300:
-                stats["times"].clear()
-                stats["ports"].clear()
-                stats["syn_counts"].clear()
-                stats["icmp_times"].clear()
-                stats["last_reset"] = current_time
-                logger.debug(f"Reset counters for {src_ip} due to inactivity")
-
-            # Rule-based detection first
-            threat_key = None
-            threat_type = None
-            severity = "medium"
-            details = ""
-
-            # DDoS
-            if len(stats["times"]) > 5:
-                time_span = stats["times"][-1] - stats["times"][0]
-                packet_rate = len(stats["times"]) / (time_span if time_span > 0 else 1)
-                threat_key = f"{src_ip}:DDoS"
-                if packet_rate > 10 and time_span > 5:
-                    threat_type = "DDoS"
-                    severity = "high"
-                    details = f"Sustained rate: {packet_rate:.2f} pps over {time_span:.1f}s"
-
-            # Port Scan
-            if TCP in pkt or UDP in pkt:
-                threat_key = f"{src_ip}:PortScan"
-                if len(stats["ports"]) > 3 and len(stats["times"]) > 1:
-                    time_span = stats["times"][-1] - stats["times"][0]
-                    if time_span < 3:
-                        threat_type = "Port Scan"
-                        details = f"Hit {len(stats['ports'])} ports in {time_span:.1f}s"
-
-            # Brute Force
-            if TCP in pkt and pkt[TCP].flags == "S":
-                port = pkt[TCP].dport
-                threat_key = f"{src_ip}:BruteForce:{port}"
-                if stats["syn_counts"][port] > 5 and len(stats["times"]) > 1:
-                    time_span = stats["times"][-1] - stats["times"][0]
-                    if time_span < 5:
-                        threat_type = "Brute Force"
-                        details = f"{stats['syn_counts'][port]} SYNs to port {port} in {time_span:.1f}s"
-
-            # ICMP Flood
-            if pkt.haslayer(ICMP) and pkt[ICMP].type == 8:
-                threat_key = f"{src_ip}:ICMPFlood"
-                icmp_len = len(stats["icmp_times"])
-                time_span = stats["icmp_times"][-1] - stats["icmp_times"][0] if icmp_len > 1 else 0
-                logger.debug(f"ICMP stats for {src_ip}: len={icmp_len}, time_span={time_span:.2f}s")
-                if icmp_len > 10 and time_span < 3:
-                    threat_type = "ICMP Flood"
-                    details = f"{icmp_len} pings in {time_span:.1f}s"
+            stats = self.packet_counts.get(src_ip)
+            if stats is None:
+                if self._stats_pool:
+                    stats = self._stats_pool.pop()
+                    stats.reset(current_time)  # Cheap: emptied when pooled
+                    stats.packet_count = 0
+                else:
+                    stats = _SourceStats(current_time)
+                self.packet_counts[src_ip] = stats
+            stats.times.append(current_time)
+            stats.packet_count += 1
+            if dport is not None:
+                stats.ports.add(dport)
+            if pkt_class == _PKT_TCP_SYN:
+                if stats.syn_counts is None:
+                    stats.syn_counts = defaultdict(int)
+                stats.syn_counts[dport] += 1
+                stats.syn_total += 1
+            elif pkt_class == _PKT_ICMP_ECHO:
+                if stats.icmp_times is None:
+                    stats.icmp_times = deque(maxlen=500)
+                stats.icmp_times.append(current_time)
+
+            if current_time - stats.last_reset > 300:
+                stats.reset(current_time)
+                logger.debug("Reset counters for %08x due to inactivity", src_ip)
+
+            # Rule-based detection first; strings are only built for a hit
+            verdict = _RULES[pkt_class](stats, dport)
 
             # If a threat is detected by rules, proceed with evaluation
-            if threat_type:
+            if verdict is not None:
+                kind, threat_type, severity, details = verdict
+                threat_key = (src_ip, kind, dport if kind == _KIND_BRUTE_FORCE else None)
+
                 # Check if this threat was previously reported
-                if threat_key in self.reported_threats:
-                    logger.debug(f"Threat {threat_key} already reported, skipping")
+                if threat_key in self.reported_threats or threat_key in self._reported_prev:
+                    logger.debug("Threat %s already reported, skipping", threat_key)
                     return
 
                 # Check if we've recently attempted to detect this threat
                 if threat_key in self.detection_attempts:
                     last_attempt_time = self.detection_attempts[threat_key]["time"]
                     if current_time - last_attempt_time < 30:  # 30-second window for re-evaluation
-                        logger.debug(f"Recent detection attempt for {threat_key}, skipping")
+                        logger.debug("Recent detection attempt for %s, skipping", threat_key)
                         return
                     else:
-                        logger.debug(f"Re-evaluating {threat_key} after {current_time - last_attempt_time:.1f}s")
+                        logger.debug("Re-evaluating %s after %.1fs", threat_key, current_time - last_attempt_time)
 
-                features = self._extract_features(pkt, stats)
-                logger.debug(f"Extracted features for {src_ip}: {features}")
+                features = self._extract_features(pkt_class, stats, current_time)
+                logger.debug("Extracted features for %s: %s", threat_key, features)
                 if self.session:
-                    prediction = asyncio.run_coroutine_threadsafe(self._predict_with_ml(features), self.loop).result()
-                    logger.debug(f"ML Prediction for {src_ip}: {prediction}")
-                    if prediction and prediction["prediction"] == 1 and prediction["probability"] >= 0.01:  # Keep threshold low for now
-                        severity = "high" if prediction["probability"] >= 0.5 else "medium"
-                        details += f" (ML prob: {prediction['probability']:.2f})"
-                        threat = self._create_threat(src_ip, threat_type, severity, details)
-                        self._report_threat(threat, threat_key)
+                    # The prediction is awaited on the event loop, never here:
+                    # blocking the sniffer on the API round-trip drops packets
+                    if threat_key in self._ml_pending:
+                        logger.debug("ML prediction for %s already pending, skipping", threat_key)
+                        return
+                    cache_key = _feature_key(features)
+                    prediction = self._ml_cache.get(cache_key)
+                    if prediction is not None:
+                        self._apply_prediction(prediction, src_ip, threat_key, threat_type, details, current_time)
                     else:
-                        logger.debug(f"ML rejected threat from {src_ip}: {prediction}")
-                        # Log the detection attempt but do not add to reported_threats
-                        self.detection_attempts[threat_key] = {"time": current_time}
+                        self._ml_pending.add(threat_key)
+                        future = asyncio.run_coroutine_threadsafe(self._predict_with_ml(features), self.loop)
+                        future.add_done_callback(functools.partial(
+                            self._on_prediction, cache_key, src_ip, threat_key, threat_type, details, current_time))
                 else:
                     # No ML, use rule-based only
-                    threat = self._create_threat(src_ip, threat_type, severity, details)
+                    threat = self._create_threat(src_ip, threat_type, severity, details, current_time)
                     self._report_threat(threat, threat_key)
 
-            if int(current_time) % 60 == 0:
-                self._cleanup_threats(current_time)
-
         except Exception as e:
             logger.error(f"Error analyzing packet: {str(e)}")
 
-    def _create_threat(self, src_ip: str, threat_type: str, severity: str, details: str) -> Dict[str, Any]:
+    def _on_prediction(self, cache_key: tuple, src_ip: int, threat_key: tuple, threat_type: str,
+                       details: str, detected_at: float, future):
+        # Runs on the event loop once the ML request finishes
+        try:
+            prediction = None if future.cancelled() else future.result()
+            if prediction is not None:
+                if len(self._ml_cache) >= _ML_CACHE_SIZE:
+                    del self._ml_cache[next(iter(self._ml_cache))]
+                self._ml_cache[cache_key] = prediction
+            self._apply_prediction(prediction, src_ip, threat_key, threat_type, details, detected_at)
+        except Exception as e:
+            logger.error(f"Error handling ML prediction: {str(e)}")
+        finally:
+            self._ml_pending.discard(threat_key)
+
+    def _apply_prediction(self, prediction: Optional[Dict[str, float]], src_ip: int, threat_key: tuple,
+                          threat_type: str, details: str, detected_at: float):
+        logger.debug("ML Prediction for %s: %s", threat_key, prediction)
+        if prediction and prediction["prediction"] == 1 and prediction["probability"] >= 0.01:  # Keep threshold low for now
+            severity = "high" if prediction["probability"] >= 0.5 else "medium"
+            details += f" (ML prob: {prediction['probability']:.2f})"
+            threat = self._create_threat(src_ip, threat_type, severity, details, detected_at)
+            self._report_threat(threat, threat_key)
+        else:
+            logger.debug("ML rejected threat %s: %s", threat_key, prediction)
+            # Log the detection attempt but do not add to reported_threats
+            self.detection_attempts[threat_key] = {"time": detected_at}
+
+    def _create_threat(self, src_ip: int, threat_type: str, severity: str, details: str,
+                       detected_at: float) -> Dict[str, Any]:
+        # The id is assigned from a counter by data_manager.add_threat, and the
+        # timestamp reuses the packet's arrival time instead of a second clock read
         try:
             threat = {
-                "id": f"threat-{uuid.uuid4().hex[:8]}",
-                "source": src_ip,
+                "source": _ip_str(src_ip),
                 "destination": self.local_ip,
                 "type": threat_type,
                 "severity": severity,
                 "status": "detected",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": self._iso_timestamp(detected_at),
+                "ts_epoch": detected_at,
                 "details": details
             }
-            logger.info(f"Created threat: {threat}")
+            logger.info("Created threat: %s", threat)
             return threat
         except Exception as e:
             logger.error(f"Error creating threat: {str(e)}")
             return {}
 
-    def _report_threat(self, threat: Dict[str, Any], threat_key: str):
+    def _iso_timestamp(self, epoch: float) -> str:
+        # Display stamp at millisecond granularity: one tripped scan or flood
+        # reports many threats within the same ms, so the last string is
+        # reused. The (key, text) pair is swapped in whole, since the sniffer
+        # and the ML callbacks both create threats.
+        key = int(epoch * 1000)
+        cached_key, text = self._iso_cache
+        if key != cached_key:
+            text = datetime.fromtimestamp(key / 1000).isoformat()
+            self._iso_cache = (key, text)
+        return text
+
+    def _report_threat(self, threat: Dict[str, Any], threat_key: tuple):
         try:
-            self.reported_threats[threat_key] = time.time()
-            self.data_manager.add_threat(threat)
-            data = self.data_manager.load_data()
-            stats = data.get("stats", {})
-            stats["total_threats"] = len(data.get("threats", []))
-            stats["blocked_attacks"] = len(data.get("firewall_rules", []))
-            self.data_manager.update_stats(stats)
-
-            if self.websocket_manager is None:
-                logger.warning("WebSocket manager is None. Cannot broadcast threat.")
-            else:
-                logger.debug(f"Attempting to broadcast threat: {threat}")
-                asyncio.run_coroutine_threadsafe(
-                    self.websocket_manager.broadcast({
-                        "type": "threat_update",
-                        "data": {
-                            "threat": threat,
-                            "stats": stats
-                        }
-                    }),
-                    self.loop
-                )
-                logger.info(f"Threat broadcasted: {threat['type']} from {threat['source']}")
+            self.reported_threats.add(threat_key)
+            if len(self.reported_threats) >= _DEDUP_GENERATION_SIZE:
+                self._rotate_reported(time.time())
+            self.data_manager.add_threat(threat)  # Also bumps stats["total_threats"]
+            if len(self._pending_threats) >= _BROADCAST_BACKLOG:
+                logger.warning(f"Broadcast backlog full, dropping threat update: {threat['type']} from {threat['source']}")
+                return
+            self._pending_threats.append(threat)
+            if not self._wakeup_pending:
+                self._wakeup_pending = True
+                self.loop.call_soon_threadsafe(self._threats_ready.set)
         except Exception as e:
             logger.error(f"Failed to report threat: {str(e)}")
 
+    async def _broadcast_worker(self):
+        # One consumer drains whatever has queued up and sends it as a single
+        # message, instead of one task and one frame per threat.
+        pending = self._pending_threats
+        while True:
+            await self._threats_ready.wait()
+            # Producers see the wakeup as still pending during this pause, so
+            # the rest of a burst is appended without further loop wakeups
+            await asyncio.sleep(_BROADCAST_DELAY)
+            self._threats_ready.clear()
+            # Cleared before draining: a threat appended after this point
+            # either gets drained below or schedules a fresh wakeup
+            self._wakeup_pending = False
+            while pending:
+                batch = [pending.popleft() for _ in range(min(_BROADCAST_BATCH, len(pending)))]
+                if self.websocket_manager is None:
+                    logger.warning("WebSocket manager is None. Cannot broadcast threat.")
+                    continue
+                try:
+                    await self.websocket_manager.broadcast({
+                        "type": "threats_update",
+                        "data": {
+                            "threats": batch,
+                            "stats": dict(self.data_manager.get_stats())
+                        }
+                    })
+                    logger.info("Threats broadcasted: %d", len(batch))
+                except Exception as e:
+                    logger.error(f"Failed to broadcast threats: {str(e)}")
+
+    async def _cleanup_loop(self):
+        # The sweep walks every tracked source, which under a spoofed-source
+        # flood is large enough to stall WebSocket traffic; run it off the loop
+        while True:
+            await asyncio.sleep(_CLEANUP_INTERVAL)
+            await self.loop.run_in_executor(None, self._cleanup_threats, time.time())
+
     def _cleanup_threats(self, current_time: float):
+        # Other threads keep writing to these dicts during the sweep, so stale
+        # keys are deleted in place (rechecked just before the delete) instead
+        # of rebuilding the dicts and dropping concurrent writes
         try:
-            self.packet_counts = {
-                ip: stats for ip, stats in self.packet_counts.items()
-                if current_time - stats["last_reset"] < 300
-            }
-            self.reported_threats = {
-                k: v for k, v in self.reported_threats.items()
-                if current_time - v < 300
-            }
-            self.detection_attempts = {
-                k: v for k, v in self.detection_attempts.items()
-                if current_time - v["time"] < 300
-            }
+            cutoff = current_time - _TRACKING_TTL
+            # Sources are evicted by last activity; last_reset alone would
+            # also drop a source that is still sending, 300s into its window
+            for ip, stats in list(self.packet_counts.items()):
+                if stats.last_seen() <= cutoff and self.packet_counts.pop(ip, None) is stats:
+                    if len(self._stats_pool) < _STATS_POOL_SIZE:
+                        stats.reset(current_time)
+                        self._stats_pool.append(stats)
+            if current_time - self._reported_rotated >= _TRACKING_TTL:
+                self._rotate_reported(current_time)
+            for key, attempt in list(self.detection_attempts.items()):
+                if attempt["time"] <= cutoff and self.detection_attempts.get(key) is attempt:
+                    self.detection_attempts.pop(key, None)
             logger.debug("Cleaned up old packet counts, reported threats, and detection attempts")
         except Exception as e:
             logger.error(f"Error cleaning up threats: {str(e)}")
 
+    def _rotate_reported(self, now: float):
+        # The current set is demoted before it is replaced, so a concurrent
+        # lookup always sees it in one of the two slots
+        self._reported_prev = self.reported_threats
+        self.reported_threats = set()
+        self._reported_rotated = now
+
     def reset_monitoring(self):
         try:
             self.packet_counts.clear()
             self.reported_threats.clear()
+            self._reported_prev.clear()
             self.detection_attempts.clear()
             logger.info("Monitoring reset, restarting packet sniffing")
         except Exception as e:
@@ -341,36 +810,42 @@ class SecurityMonitor:
 
     def get_current_stats(self) -> Dict[str, Any]:
         try:
-            data = self.data_manager.load_data()
-            threats = data.get("threats", [])
-            firewall_rules = data.get("firewall_rules", [])
-            stats = {
-                "total_threats": len(threats),
-                "blocked_attacks": len(firewall_rules),
-                "network_traffic": f"{(psutil.net_io_counters().bytes_sent + psutil.net_io_counters().bytes_recv) / 1024 / 1024/10:.1f} MB",
-                "active_users": len(psutil.users())
+            counters = self.data_manager.get_stats()
+            network_traffic, active_users = self._read_host_stats()
+            return {
+                "total_threats": counters["total_threats"],
+                "blocked_attacks": counters["blocked_attacks"],
+                "network_traffic": network_traffic,
+                "active_users": active_users
             }
-            self.data_manager.update_stats(stats)
-            return stats
         except Exception as e:
             logger.error(f"Error getting stats: {str(e)}")
             return {"total_threats": 0, "blocked_attacks": 0, "network_traffic": "0 MB", "active_users": 0}
 
+    def _read_host_stats(self) -> Tuple[str, int]:
+        # The psutil calls are syscalls; threat/rule counters are read live
+        # by the caller, so only these are reused for up to _HOST_STATS_TTL
+        now = time.monotonic()
+        read_at, cached = self._host_stats
+        if cached is not None and now - read_at < _HOST_STATS_TTL:
+            return cached
+        io = psutil.net_io_counters()
+        cached = (f"{(io.bytes_sent + io.bytes_recv) / (1024 * 1024 * 10):.1f} MB", len(psutil.users()))
+        self._host_stats = (now, cached)
+        self.data_manager.update_stats({"network_traffic": cached[0], "active_users": cached[1]})
+        return cached
+
     def get_recent_threats(self, limit: int = 10) -> List[Dict[str, Any]]:
         try:
-            data = self.data_manager.load_data()
-            threats = data.get("threats", [])
-            return sorted(threats, key=lambda x: x.get("timestamp", ""), reverse=True)[:limit]
+            return self.data_manager.recent_threats(limit)
         except Exception as e:
             logger.error(f"Error getting recent threats: {str(e)}")
             return []
 
     def get_active_threats(self) -> List[Dict[str, Any]]:
         try:
-            data = self.data_manager.load_data()
-            threats = data.get("threats", [])
-            one_hour_ago = (datetime.now() - timedelta(hours=1)).isoformat()
-            return [threat for threat in threats if threat.get("status") == "detected" and threat.get("timestamp", "") > one_hour_ago]
+            threats = self.data_manager.threats_since(time.time() - 3600)
+            return [threat for threat in reversed(threats) if threat.get("status") == "detected"]
         except Exception as e:
             logger.error(f"Error getting active threats: {str(e)}")
             return []
\ No newline at end of file
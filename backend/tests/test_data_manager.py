@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+import data_manager
+from data_manager import DataManager
+
+@pytest.fixture
+def open_store(tmp_path):
+    """Open stores on one data file; the long checkpoint interval leaves changes in the WAL."""
+    stores = []
+
+    def open_store():
+        store = DataManager(str(tmp_path / "security_data.json"), checkpoint_interval=3600.0)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store._final_flush()
+
+_TORN_RECORD = b'{"seq": 99, "op": "add_threat", "p": {"id": "threat-99", "sou'
+
+def _tear_wal(store):
+    # A crash mid-append leaves the last record without its newline
+    store._drain_wal()
+    with open(store.wal_path, "ab") as f:
+        f.write(_TORN_RECORD)
+
+def test_replay_discards_truncated_final_wal_line(open_store):
+    store = open_store()
+    for source in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+        assert store.add_threat({"source": source, "type": "Port Scan"})
+    _tear_wal(store)
+
+    reopened = open_store()
+    assert [t["id"] for t in reopened.cache["threats"]] == ["threat-1", "threat-2", "threat-3"]
+    assert reopened.get_stats()["total_threats"] == 3
+    assert reopened.get_threat("threat-99") is None
+
+def test_appends_after_torn_record_are_replayed(open_store):
+    _tear_wal(open_store())
+    reopened = open_store()
+    assert reopened.add_threat({"source": "10.0.0.4", "type": "Port Scan"})
+    reopened._drain_wal()
+
+    # Glued onto the torn bytes, the new record would be lost on the next replay
+    with open(reopened.wal_path, "rb") as f:
+        assert _TORN_RECORD not in f.read()
+    assert open_store().get_threat("threat-1")["source"] == "10.0.0.4"
+
+def test_replay_skips_records_already_in_checkpoint(open_store):
+    store = open_store()
+    assert store.add_threat({"source": "10.0.0.1", "type": "DDoS"})
+    assert store.flush()
+    assert store.add_threat({"source": "10.0.0.2", "type": "DDoS"})
+    store._drain_wal()
+
+    reopened = open_store()
+    assert [t["id"] for t in reopened.cache["threats"]] == ["threat-1", "threat-2"]
+    assert reopened.get_stats()["total_threats"] == 2
+
+def test_counters_persist_across_reset_data(open_store):
+    store = open_store()
+    assert store.add_threat({"source": "10.0.0.1", "type": "DDoS"})
+    assert store.add_firewall_rule({"source_ip": "10.0.0.1", "action": "block"})
+    assert store.reset_data()
+    assert not store.cache["threats"] and not store.cache["firewall_rules"]
+
+    # Ids are never handed out twice, even once the records are gone
+    assert store.add_threat({"source": "10.0.0.2", "type": "DDoS"})
+    assert store.add_firewall_rule({"source_ip": "10.0.0.2", "action": "block"})
+    assert store.get_threat("threat-2") is not None
+    assert store.get_firewall_rule("rule-2") is not None
+
+    assert store.reset_data()
+    reopened = open_store()
+    assert reopened.add_threat({"source": "10.0.0.3", "type": "DDoS"})
+    assert reopened.get_threat("threat-3") is not None
+
+def test_update_threats_by_source_skips_unchanged(open_store):
+    store = open_store()
+    for source in ("10.0.0.1", "10.0.0.2", "10.0.0.1"):
+        assert store.add_threat({"source": source, "type": "DDoS", "status": "detected"})
+    assert store.update_threat("threat-3", {"status": "blocked"})
+    seq = store._wal_seq
+
+    assert store.update_threats_by_source("10.0.0.1", {"status": "blocked"}) == ["threat-1"]
+    assert store._wal_seq == seq + 1
+    assert store.update_threats_by_source("10.0.0.1", {"status": "blocked"}) == []
+    assert store.update_threat("threat-1", {"status": "blocked"})
+    assert store._wal_seq == seq + 1
+
+    store._drain_wal()
+    reopened = open_store()
+    assert [t["status"] for t in reopened.cache["threats"]] == ["blocked", "detected", "blocked"]
+
+def test_snapshot_is_read_only_and_live(open_store):
+    store = open_store()
+    assert store.add_threat({"source": "10.0.0.1", "type": "DDoS"})
+    assert store.add_firewall_rule({"source_ip": "10.0.0.1", "action": "block"})
+    view = store.snapshot()
+    threats, rules = view["threats"], view["firewall_rules"]
+    for section in (threats, rules):
+        assert not hasattr(section, "append") and not hasattr(section, "clear")
+        with pytest.raises(TypeError):
+            section[0]["status"] = "blocked"
+    with pytest.raises(TypeError):
+        view["stats"]["total_threats"] = 0
+
+    assert store.add_threat({"source": "10.0.0.2", "type": "DDoS"})
+    assert [t["source"] for t in threats] == ["10.0.0.1", "10.0.0.2"]
+    assert threats[-1]["id"] == "threat-2" and rules[0]["source_ip"] == "10.0.0.1"
+
+def test_legacy_rules_without_ids_are_kept(tmp_path, open_store):
+    legacy = {"firewall_rules": [
+        {"source_ip": "10.0.0.1", "action": "block"},
+        {"source_ip": "10.0.0.2", "action": "block"},
+        {"id": "rule-5", "source_ip": "10.0.0.3", "action": "allow"},
+    ]}
+    (tmp_path / "security_data.json").write_text(json.dumps(legacy))
+    store = open_store()
+    assert sorted(store.get_firewall_rule(ip)["id"] for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3")) == [
+        "rule-5", "rule-6", "rule-7"]
+    assert store.get_stats()["blocked_attacks"] == 3
+    assert store.add_firewall_rule({"source_ip": "10.0.0.4", "action": "block"})
+    assert store.get_firewall_rule("10.0.0.4")["id"] == "rule-8"
+
+def test_zst_path_without_zstandard(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_manager, "zstandard", None)
+    store = DataManager(str(tmp_path / "security_data.json.zst"))
+    try:
+        # The checkpoint goes under the name that matches its encoding
+        assert store.data_file_path == str(tmp_path / "security_data.json")
+        assert json.loads((tmp_path / "security_data.json").read_bytes()) is not None
+        assert not (tmp_path / "security_data.json.zst").exists()
+    finally:
+        store._final_flush()
+
+    (tmp_path / "security_data.json.zst").write_bytes(b"\x28\xb5\x2f\xfd")
+    with pytest.raises(RuntimeError):
+        DataManager(str(tmp_path / "security_data.json.zst"))
@@ -0,0 +1,125 @@
+import random
+from collections import defaultdict, deque
+
+import pytest
+
+from security_monitor import (
+    _KIND_BRUTE_FORCE, _KIND_DDOS, _KIND_ICMP_FLOOD, _KIND_PORT_SCAN,
+    _PKT_ICMP, _PKT_ICMP_ECHO, _PKT_OTHER, _PKT_TCP, _PKT_TCP_SYN, _PKT_UDP,
+    _RULES, _SourceStats,
+)
+
+def _feed(stats, pkt_class, dport, now):
+    # The per-source bookkeeping _analyze_packet does before running the rules
+    stats.times.append(now)
+    if dport is not None:
+        stats.ports.add(dport)
+    if pkt_class == _PKT_TCP_SYN:
+        if stats.syn_counts is None:
+            stats.syn_counts = defaultdict(int)
+        stats.syn_counts[dport] += 1
+    elif pkt_class == _PKT_ICMP_ECHO:
+        if stats.icmp_times is None:
+            stats.icmp_times = deque(maxlen=500)
+        stats.icmp_times.append(now)
+    return _RULES[pkt_class](stats, dport)
+
+def _reference_verdict(stats, pkt_class, dport):
+    # The sequential if-chain the _RULES table replaced, kept as the oracle
+    kind = None
+    threat_type = None
+    severity = "medium"
+    details = ""
+    times = stats.times
+    window = len(times)
+    time_span = times[-1] - times[0] if window > 1 else 0
+    packet_rate = window / (time_span if time_span > 0 else 1)
+    if window > 5:
+        kind = _KIND_DDOS
+        if packet_rate > 10 and time_span > 5:
+            threat_type = "DDoS"
+            severity = "high"
+            details = f"Sustained rate: {packet_rate:.2f} pps over {time_span:.1f}s"
+    if dport is not None:
+        kind = _KIND_PORT_SCAN
+        if window > 1 and time_span < 3 and len(stats.ports) > 3:
+            threat_type = "Port Scan"
+            details = f"Hit {len(stats.ports)} ports in {time_span:.1f}s"
+    if pkt_class == _PKT_TCP_SYN:
+        kind = _KIND_BRUTE_FORCE
+        syn_count = stats.syn_counts[dport]
+        if window > 1 and time_span < 5 and syn_count > 5:
+            threat_type = "Brute Force"
+            details = f"{syn_count} SYNs to port {dport} in {time_span:.1f}s"
+    elif pkt_class == _PKT_ICMP_ECHO:
+        kind = _KIND_ICMP_FLOOD
+        icmp_times = stats.icmp_times
+        icmp_len = len(icmp_times)
+        if icmp_len > 10:
+            icmp_span = icmp_times[-1] - icmp_times[0]
+            if icmp_span < 3:
+                threat_type = "ICMP Flood"
+                details = f"{icmp_len} pings in {icmp_span:.1f}s"
+    if threat_type is None:
+        return None
+    return kind, threat_type, severity, details
+
+def _burst(pkt_class, dports, gap, start=1000.0):
+    stats = _SourceStats(start)
+    verdict = None
+    for i, dport in enumerate(dports):
+        verdict = _feed(stats, pkt_class, dport, start + i * gap)
+    return verdict
+
+def test_port_scan():
+    assert _burst(_PKT_UDP, [53, 80, 123, 161, 443], 0.1) == (
+        _KIND_PORT_SCAN, "Port Scan", "medium", "Hit 5 ports in 0.4s")
+
+def test_brute_force():
+    assert _burst(_PKT_TCP_SYN, [22] * 7, 0.1) == (
+        _KIND_BRUTE_FORCE, "Brute Force", "medium", "7 SYNs to port 22 in 0.6s")
+
+def test_icmp_flood():
+    assert _burst(_PKT_ICMP_ECHO, [None] * 12, 0.1) == (
+        _KIND_ICMP_FLOOD, "ICMP Flood", "medium", "12 pings in 1.1s")
+
+def test_ddos():
+    assert _burst(_PKT_OTHER, [None] * 121, 0.05) == (
+        _KIND_DDOS, "DDoS", "high", "Sustained rate: 20.17 pps over 6.0s")
+
+def test_icmp_flood_during_ddos_is_high_severity():
+    stats = _SourceStats(1000.0)
+    for i in range(120):
+        _feed(stats, _PKT_ICMP, None, 1000.0 + i * 0.05)
+    verdict = None
+    for i in range(12):
+        verdict = _feed(stats, _PKT_ICMP_ECHO, None, 1006.0 + i * 0.01)
+    assert verdict[:3] == (_KIND_ICMP_FLOOD, "ICMP Flood", "high")
+
+def test_quiet_traffic_is_not_flagged():
+    for pkt_class, dport in ((_PKT_TCP, 443), (_PKT_TCP_SYN, 22), (_PKT_UDP, 53), (_PKT_ICMP_ECHO, None)):
+        assert _burst(pkt_class, [dport] * 5, 2.0) is None
+
+# Class/port combinations the header decoder can produce: TCP and UDP lose
+# their port on non-first fragments, a SYN always has one, ICMP never does
+_REACHABLE = (
+    (_PKT_OTHER, (None,)),
+    (_PKT_TCP, (None, 22, 80, 443, 8080, 3389)),
+    (_PKT_TCP_SYN, (22, 80, 443, 8080, 3389)),
+    (_PKT_UDP, (None, 53, 123, 161, 500)),
+    (_PKT_ICMP, (None,)),
+    (_PKT_ICMP_ECHO, (None,)),
+)
+
+@pytest.mark.parametrize("seed", range(40))
+def test_rule_table_matches_if_chain(seed):
+    rng = random.Random(seed)
+    classes = rng.sample(_REACHABLE, rng.randint(1, len(_REACHABLE)))
+    gap = rng.choice((0.002, 0.02, 0.08, 0.3))
+    stats = _SourceStats(0.0)
+    now = 0.0
+    for _ in range(400):
+        pkt_class, ports = rng.choice(classes)
+        dport = rng.choice(ports)
+        now += rng.expovariate(1 / gap)
+        assert _feed(stats, pkt_class, dport, now) == _reference_verdict(stats, pkt_class, dport)
@@ -44,6 +44,14 @@ export type UseWebSocketReturn = {
   updateSecurityData: (data: Partial<{ connected: boolean; stats: SecurityStats; threats: Threat[]; firewallRules: FirewallRule[]; alerts: Alert[] }>) => void;
 };
 
+const threatAlert = (threat: Threat): Alert => ({
+  id: threat.id,
+  type: threat.severity === "high" ? "error" : threat.severity === "medium" ? "warning" : "success",
+  title: `New Threat: ${threat.type}`,
+  description: `${threat.source} - ${threat.details || "No details available"}`,
+  time: new Date(threat.timestamp).toISOString(),
+});
+
 const initializeWebSocket = (
   updateSecurityData: (data: Partial<{ connected: boolean; stats: SecurityStats; threats: Threat[]; firewallRules: FirewallRule[]; alerts: Alert[] }>) => void,
   setLockdownState: (isLocked: boolean) => void
@@ -171,17 +179,20 @@ export const useWebSocket = (): UseWebSocketReturn => {
         const newThreat = message.data.threat;
         console.log("New threat timestamp:", newThreat.timestamp);
         const updatedThreats = threats.filter(t => t.id !== newThreat.id).concat(newThreat);
-        const newThreatAlert: Alert = {
-          id: newThreat.id,
-          type: newThreat.severity === "high" ? "error" : newThreat.severity === "medium" ? "warning" : "success",
-          title: `New Threat: ${newThreat.type}`,
-          description: `${newThreat.source} - ${newThreat.details || "No details available"}`,
-          time: new Date(newThreat.timestamp).toISOString(),
-        };
         updateSecurityData({
           stats: message.data.stats,
           threats: updatedThreats,
-          alerts: [...alerts, newThreatAlert],
+          alerts: [...alerts, threatAlert(newThreat)],
+        });
+        break;
+      case "threats_update":
+        console.log("Received threats update:", message.data);
+        const batch: Threat[] = message.data.threats;
+        const batchIds = new Set(batch.map(t => t.id));
+        updateSecurityData({
+          stats: message.data.stats,
+          threats: threats.filter(t => !batchIds.has(t.id)).concat(batch),
+          alerts: [...alerts, ...batch.map(threatAlert)],
         });
         break;
       case "firewall_update":